@@ -1,16 +1,18 @@
 """Business Functions"""
 
 import logging
-from datetime import datetime, timedelta
-import pytz
 from time import sleep
+from typing import Dict, List, Optional
 
 from exceptions import MyFoxInitError
 import schedule
+from requests.exceptions import HTTPError
 from myfox.api import MyFoxApi
+from myfox.api.ratelimit import Priority
 from myfox.api.devices.category import Category
 from homeassistant.ha_discovery import (
     ha_discovery_alarm,
+    ha_discovery_diagnostics,
     ha_discovery_history,
     ha_discovery_alarm_actions,
     ha_discovery_cameras,
@@ -19,11 +21,97 @@ from homeassistant.ha_discovery import (
     DEVICE_CAPABILITIES,
     ALARM_STATUS,
 )
-from business.mqtt import mqtt_publish, SUBSCRIBE_TOPICS
+from homeassistant.discovery_cache import (
+    DISCOVERY_CACHE_PATH,
+    discovery_digest,
+    read_discovery_digests,
+    write_discovery_digests,
+)
+from business.diagnostics import DIAGNOSTIC_SENSORS, diagnostics_enabled
+from business.history import (
+    advance_history_cursor,
+    event_published,
+    event_timestamps,
+    fetch_new_events,
+    history_dedup_metrics,
+    remember_event,
+    site_zone,
+)
+from business.mqtt import (
+    mqtt_publish,
+    publish_discovery_config,
+    publish_history_event,
+    publish_site_state,
+    publish_snapshot,
+    remember_discovery_config,
+    remove_discovery_config,
+    SUBSCRIBE_TOPICS,
+)
+from business.pipeline import run_per_site
+from business.polling import DEVICE_FAMILIES, due_families, last_payload, observe, poll_now
+from business.snapshot import record_site_event, snapshot_due, snapshot_variants
 from mqtt import MQTTClient
 
 LOGGER = logging.getLogger(__name__)
-HISTORY = {}
+
+# Device endpoints indexed by ha_devices_config, cameras are found in "devices"
+DISCOVERY_ENDPOINTS = ["devices", "temperature", "light", "state", "other", "shutter", "gate", "socket"]
+
+
+def index_by_device_id(items: Optional[List[Dict]]) -> Dict[str, Dict]:
+    """Index an endpoint payload by deviceId
+
+    Args:
+        items (Optional[List[Dict]]): Endpoint items
+
+    Returns:
+        Dict[str, Dict]: Items by Device ID
+    """
+    return {item.get("deviceId"): item for item in items or [] if item}
+
+
+def publish_discovery(
+    mqtt_client: MQTTClient,
+    discovery: Dict[str, Dict],
+    cache_path: str,
+    unavailable_sites: Optional[List[str]] = None,
+) -> None:
+    """Publish added or changed discovery configs and remove vanished ones
+
+    Digests are only kept for configs accepted by the client (QoS 1), every config is published
+    again on (re)connect, see republish_discovery.
+
+    Args:
+        mqtt_client (MQTTClient): MQTTClient
+        discovery (Dict[str, Dict]): Discovery configs by topic
+        cache_path (str): Digests file of the previously published configs
+        unavailable_sites (Optional[List[str]], optional): Sites whose devices could not be fetched,
+            their configs are kept. Defaults to None.
+    """
+    published = read_discovery_digests(cache_path=cache_path)
+    digests = {topic: discovery_digest(config) for topic, config in discovery.items()}
+    kept = tuple(f"/{site_id}_" for site_id in unavailable_sites or [])
+
+    changed = [topic for topic, digest in digests.items() if published.get(topic) != digest]
+    removed = [topic for topic in published if topic not in digests and not any(site in topic for site in kept)]
+    LOGGER.info(
+        f"Discovery: {len(changed)} config(s) added or changed, {len(removed)} removed, "
+        f"{len(digests) - len(changed)} unchanged"
+    )
+    for topic in discovery:
+        if topic in changed:
+            if not publish_discovery_config(mqtt_client=mqtt_client, topic=topic, config=discovery[topic]):
+                # Not sent, published again on next run
+                digests.pop(topic)
+        else:
+            # Only remembered, to be published again on (re)connect
+            remember_discovery_config(topic=topic, config=discovery[topic])
+    for topic in removed:
+        if remove_discovery_config(mqtt_client=mqtt_client, topic=topic):
+            published.pop(topic)
+    # Configs of unavailable sites and removals not sent yet are kept
+    digests.update({topic: digest for topic, digest in published.items() if topic not in discovery})
+    write_discovery_digests(digests, cache_path=cache_path)
 
 
 def ha_sites_config(
@@ -37,60 +125,73 @@ def ha_sites_config(
     LOGGER.info("Looking for Sites")
     for site_id in my_sites_id:
         # Alarm Status
-        my_sites = api.get_sites()
-        for my_site in my_sites:
-            if my_site.siteId == site_id:
-                site = ha_discovery_alarm(
+        my_site = api.get_cached_site(site_id=site_id)
+        if my_site is None:
+            LOGGER.warning(f"Site {site_id} not found")
+            continue
+        site = ha_discovery_alarm(
+            site=my_site,
+            mqtt_config=mqtt_config,
+            homeassistant_config=homeassistant_config,
+        )
+        # site_extended = ha_discovery_alarm_actions(
+        #    site=my_site, mqtt_config=mqtt_config
+        # )
+        # configs = [site, site_extended]
+        configs = [site]
+        for site_config in configs:
+            publish_discovery_config(
+                mqtt_client=mqtt_client,
+                topic=site_config.get("topic"),
+                config=site_config.get("config"),
+            )
+            mqtt_client.client.subscribe(site_config.get("config").get("command_topic"))
+            SUBSCRIBE_TOPICS.append(site_config.get("config").get("command_topic"))
+
+        history = ha_discovery_history(
+            site=my_site,
+            mqtt_config=mqtt_config,
+        )
+        configs = [history]
+        for history_config in configs:
+            publish_discovery_config(
+                mqtt_client=mqtt_client,
+                topic=history_config.get("topic"),
+                config=history_config.get("config"),
+            )
+
+        # Bridge Diagnostics
+        if diagnostics_enabled():
+            for sensor_name, sensor_config in DIAGNOSTIC_SENSORS.items():
+                diagnostic = ha_discovery_diagnostics(
                     site=my_site,
                     mqtt_config=mqtt_config,
-                    homeassistant_config=homeassistant_config,
+                    sensor_name=sensor_name,
+                    sensor_config=sensor_config,
+                )
+                publish_discovery_config(
+                    mqtt_client=mqtt_client,
+                    topic=diagnostic.get("topic"),
+                    config=diagnostic.get("config"),
                 )
-                # site_extended = ha_discovery_alarm_actions(
-                #    site=my_site, mqtt_config=mqtt_config
-                # )
-                # configs = [site, site_extended]
-                configs = [site]
-                for site_config in configs:
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=site_config.get("topic"),
-                        payload=site_config.get("config"),
-                        retain=True,
-                    )
-                    mqtt_client.client.subscribe(site_config.get("config").get("command_topic"))
-                    SUBSCRIBE_TOPICS.append(site_config.get("config").get("command_topic"))
 
-                history = ha_discovery_history(
+        # Scenarios
+        scenarios = api.get_scenarios(site_id=site_id)
+        for scenario in scenarios:
+            if scenario.get("typeLabel") == "onDemand":
+                LOGGER.info(f"Found Scenario onDemand {scenario.get('label')}: {scenario.get('scenarioId')}")
+                play_scenario = ha_discovery_scenario_actions(
                     site=my_site,
+                    scenario=scenario,
                     mqtt_config=mqtt_config,
                 )
-                configs = [history]
-                for history_config in configs:
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=history_config.get("topic"),
-                        payload=history_config.get("config"),
-                        retain=True,
-                    )
-
-                # Scenarios
-                scenarios = api.get_scenarios(site_id=site_id)
-                for scenario in scenarios:
-                    if scenario.get("typeLabel") == "onDemand":
-                        LOGGER.info(f"Found Scenario onDemand {scenario.get('label')}: {scenario.get('scenarioId')}")
-                        play_scenario = ha_discovery_scenario_actions(
-                            site=my_site,
-                            scenario=scenario,
-                            mqtt_config=mqtt_config,
-                        )
-                        mqtt_publish(
-                            mqtt_client=mqtt_client,
-                            topic=play_scenario.get("topic"),
-                            payload=play_scenario.get("config"),
-                            retain=True,
-                        )
-                        mqtt_client.client.subscribe(play_scenario.get("config").get("command_topic"))
-                        SUBSCRIBE_TOPICS.append(play_scenario.get("config").get("command_topic"))
+                publish_discovery_config(
+                    mqtt_client=mqtt_client,
+                    topic=play_scenario.get("topic"),
+                    config=play_scenario.get("config"),
+                )
+                mqtt_client.client.subscribe(play_scenario.get("config").get("command_topic"))
+                SUBSCRIBE_TOPICS.append(play_scenario.get("config").get("command_topic"))
 
 
 def ha_devices_config(
@@ -98,19 +199,30 @@ def ha_devices_config(
     mqtt_client: MQTTClient,
     mqtt_config: dict,
     my_sites_id: list,
+    discovery_cache: str = DISCOVERY_CACHE_PATH,
 ) -> None:
-    """HA Devices Config"""
+    """HA Devices Config
+
+    Discovery configs are only published when added, changed or removed since the last run.
+    """
     LOGGER.info("Looking for Devices")
+    discovery = {}
+    unavailable_sites = []
     for site_id in my_sites_id:
-        my_devices = api.get_devices(site_id=site_id)
-        temperature_devices = api.get_devices_temperature(site_id=site_id)
-        light_devices = api.get_devices_light(site_id=site_id)
-        state_devices = api.get_devices_state(site_id=site_id)
-        other_devices = api.get_devices_other(site_id=site_id)
-        camera_devices = api.get_devices_camera(site_id=site_id)
-        shutter_devices = api.get_devices_shutter(site_id=site_id)
-        gate_devices = api.get_devices_gate(site_id=site_id)
-        socket_devices = api.get_devices_socket(site_id=site_id)
+        devices_data = api.get_site_devices_data(site_id=site_id, endpoints=DISCOVERY_ENDPOINTS)
+        my_devices = devices_data.get("devices") or []
+        if not my_devices:
+            # Probably a transient API failure, don't remove the Site entities
+            LOGGER.warning(f"No device found for site {site_id}, keeping its discovery configs")
+            unavailable_sites.append(site_id)
+            continue
+        temperature_devices = index_by_device_id(devices_data.get("temperature"))
+        light_devices = index_by_device_id(devices_data.get("light"))
+        state_devices = index_by_device_id(devices_data.get("state"))
+        other_devices = index_by_device_id(devices_data.get("other"))
+        shutter_devices = index_by_device_id(devices_data.get("shutter"))
+        gate_devices = index_by_device_id(devices_data.get("gate"))
+        socket_devices = index_by_device_id(devices_data.get("socket"))
 
         for device in my_devices:
             LOGGER.info(f"Configuring Device: {device.label}")
@@ -124,34 +236,13 @@ def ha_devices_config(
                         LOGGER.debug(f"No Config for {sensor_name}")
                         continue
 
-                    # make clean
-                    clean_device_config = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name=sensor_name,
-                    )
-
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=clean_device_config.get("topic"),
-                        payload="",
-                        retain=True,
-                    )
-
-                    # end make clean
                     device_config = ha_discovery_devices(
                         site_id=site_id,
                         device=device,
                         mqtt_config=mqtt_config,
                         sensor_name=sensor_name,
                     )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=device_config.get("topic"),
-                        payload=device_config.get("config"),
-                        retain=True,
-                    )
+                    discovery[device_config.get("topic")] = device_config.get("config")
                     if device_config.get("config").get("command_topic"):
                         mqtt_client.client.subscribe(device_config.get("config").get("command_topic"))
                         SUBSCRIBE_TOPICS.append(device_config.get("config").get("command_topic"))
@@ -168,24 +259,22 @@ def ha_devices_config(
                     device=device,
                     mqtt_config=mqtt_config,
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=camera_config.get("topic"),
-                    payload=camera_config.get("config"),
-                    retain=True,
-                )
+                discovery[camera_config.get("topic")] = camera_config.get("config")
+                for variant in snapshot_variants():
+                    variant_config = ha_discovery_cameras(
+                        site_id=site_id,
+                        device=device,
+                        mqtt_config=mqtt_config,
+                        variant=variant,
+                    )
+                    discovery[variant_config.get("topic")] = variant_config.get("config")
                 reboot = ha_discovery_devices(
                     site_id=site_id,
                     device=device,
                     mqtt_config=mqtt_config,
                     sensor_name="reboot",
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=reboot.get("topic"),
-                    payload=reboot.get("config"),
-                    retain=True,
-                )
+                discovery[reboot.get("topic")] = reboot.get("config")
                 mqtt_client.client.subscribe(reboot.get("config").get("command_topic"))
                 SUBSCRIBE_TOPICS.append(reboot.get("config").get("command_topic"))
 
@@ -195,12 +284,7 @@ def ha_devices_config(
                     mqtt_config=mqtt_config,
                     sensor_name="halt",
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=halt.get("topic"),
-                    payload=halt.get("config"),
-                    retain=True,
-                )
+                discovery[halt.get("topic")] = halt.get("config")
                 mqtt_client.client.subscribe(halt.get("config").get("command_topic"))
                 SUBSCRIBE_TOPICS.append(halt.get("config").get("command_topic"))
 
@@ -211,142 +295,100 @@ def ha_devices_config(
                     mqtt_config=mqtt_config,
                     sensor_name="snapshot",
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=device_config.get("topic"),
-                    payload=device_config.get("config"),
-                    retain=True,
-                )
+                discovery[device_config.get("topic")] = device_config.get("config")
                 if device_config.get("config").get("command_topic"):
                     mqtt_client.client.subscribe(device_config.get("config").get("command_topic"))
                     SUBSCRIBE_TOPICS.append(device_config.get("config").get("command_topic"))
 
             # Temperature
-            for temperature_device in temperature_devices:
-                if temperature_device.get("deviceId") == device.device_id:
-                    LOGGER.info(
-                        f"Found Temperature for {device.device_id}: {temperature_device.get('lastTemperature')}"
-                    )
-                    temperature = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="lastTemperature",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=temperature.get("topic"),
-                        payload=temperature.get("config"),
-                        retain=True,
-                    )
+            temperature_device = temperature_devices.get(device.device_id)
+            if temperature_device:
+                LOGGER.info(f"Found Temperature for {device.device_id}: {temperature_device.get('lastTemperature')}")
+                temperature = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="lastTemperature",
+                )
+                discovery[temperature.get("topic")] = temperature.get("config")
 
             # State
-            for state_device in state_devices:
-                if state_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found State for {device.device_id}: {state_device.get('stateLabel')}")
-                    state = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="stateLabel",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=state.get("topic"),
-                        payload=state.get("config"),
-                        retain=True,
-                    )
+            state_device = state_devices.get(device.device_id)
+            if state_device:
+                LOGGER.info(f"Found State for {device.device_id}: {state_device.get('stateLabel')}")
+                state = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="stateLabel",
+                )
+                discovery[state.get("topic")] = state.get("config")
 
             # Light
-            for light_device in light_devices:
-                if light_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found Light for {device.device_id}: {light_device.get('light')}")
-                    light = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="light",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=light.get("topic"),
-                        payload=light.get("config"),
-                        retain=True,
-                    )
+            light_device = light_devices.get(device.device_id)
+            if light_device:
+                LOGGER.info(f"Found Light for {device.device_id}: {light_device.get('light')}")
+                light = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="light",
+                )
+                discovery[light.get("topic")] = light.get("config")
 
             # Smoke
-            for other_device in other_devices:
-                if other_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found Smoke for {device.device_id}: {other_device.get('state')}")
-                    smoke = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="state",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=smoke.get("topic"),
-                        payload=smoke.get("config"),
-                        retain=True,
-                    )
+            other_device = other_devices.get(device.device_id)
+            if other_device:
+                LOGGER.info(f"Found Smoke for {device.device_id}: {other_device.get('state')}")
+                smoke = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="state",
+                )
+                discovery[smoke.get("topic")] = smoke.get("config")
 
             # Shutter
-            for shutter_device in shutter_devices:
-                if shutter_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found Shutter for {device.device_id}: {shutter_device.get('label')}")
-                    shutter = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="shutter",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=shutter.get("topic"),
-                        payload=shutter.get("config"),
-                        retain=True,
-                    )
-                    mqtt_client.client.subscribe(shutter.get("config").get("command_topic"))
-                    SUBSCRIBE_TOPICS.append(shutter.get("config").get("command_topic"))
+            shutter_device = shutter_devices.get(device.device_id)
+            if shutter_device:
+                LOGGER.info(f"Found Shutter for {device.device_id}: {shutter_device.get('label')}")
+                shutter = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="shutter",
+                )
+                discovery[shutter.get("topic")] = shutter.get("config")
+                mqtt_client.client.subscribe(shutter.get("config").get("command_topic"))
+                SUBSCRIBE_TOPICS.append(shutter.get("config").get("command_topic"))
 
             # Gate
-            for gate_device in gate_devices:
-                if gate_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found Gate for {device.device_id}: {gate_device.get('label')}")
-                    gate = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="gate",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=gate.get("topic"),
-                        payload=gate.get("config"),
-                        retain=True,
-                    )
-                    mqtt_client.client.subscribe(gate.get("config").get("command_topic"))
-                    SUBSCRIBE_TOPICS.append(gate.get("config").get("command_topic"))
+            gate_device = gate_devices.get(device.device_id)
+            if gate_device:
+                LOGGER.info(f"Found Gate for {device.device_id}: {gate_device.get('label')}")
+                gate = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="gate",
+                )
+                discovery[gate.get("topic")] = gate.get("config")
+                mqtt_client.client.subscribe(gate.get("config").get("command_topic"))
+                SUBSCRIBE_TOPICS.append(gate.get("config").get("command_topic"))
 
             # Sockets
-            for socket_device in socket_devices:
-                if socket_device.get("deviceId") == device.device_id:
-                    LOGGER.info(f"Found Socket for {device.device_id}: {socket_device.get('label')}")
-                    socket = ha_discovery_devices(
-                        site_id=site_id,
-                        device=device,
-                        mqtt_config=mqtt_config,
-                        sensor_name="socket",
-                    )
-                    mqtt_publish(
-                        mqtt_client=mqtt_client,
-                        topic=socket.get("topic"),
-                        payload=socket.get("config"),
-                        retain=True,
-                    )
-                    mqtt_client.client.subscribe(socket.get("config").get("command_topic"))
-                    SUBSCRIBE_TOPICS.append(socket.get("config").get("command_topic"))
+            socket_device = socket_devices.get(device.device_id)
+            if socket_device:
+                LOGGER.info(f"Found Socket for {device.device_id}: {socket_device.get('label')}")
+                socket = ha_discovery_devices(
+                    site_id=site_id,
+                    device=device,
+                    mqtt_config=mqtt_config,
+                    sensor_name="socket",
+                )
+                discovery[socket.get("topic")] = socket.get("config")
+                mqtt_client.client.subscribe(socket.get("config").get("command_topic"))
+                SUBSCRIBE_TOPICS.append(socket.get("config").get("command_topic"))
 
             # Works with Websockets
             if "Télécommande 4 boutons" in device.device_definition.get("device_definition_label"):
@@ -357,12 +399,7 @@ def ha_devices_config(
                     mqtt_config=mqtt_config,
                     sensor_name="presence",
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=key_fob_config.get("topic"),
-                    payload=key_fob_config.get("config"),
-                    retain=True,
-                )
+                discovery[key_fob_config.get("topic")] = key_fob_config.get("config")
 
             if "Détecteur de mouvement" in device.device_definition.get(
                 "device_definition_label"
@@ -376,21 +413,14 @@ def ha_devices_config(
                     mqtt_config=mqtt_config,
                     sensor_name="motion_sensor",
                 )
-                mqtt_publish(
-                    mqtt_client=mqtt_client,
-                    topic=pir_config.get("topic"),
-                    payload={},
-                    retain=True,
-                )
+                discovery[pir_config.get("topic")] = {}
 
-
-def convert_utc_to_paris(date: datetime) -> datetime:
-
-    utc_zone = pytz.utc
-    date = utc_zone.localize(date)
-    paris_zone = pytz.timezone("Europe/Paris")
-    paris_date = date.astimezone(paris_zone)
-    return paris_date
+    publish_discovery(
+        mqtt_client=mqtt_client,
+        discovery=discovery,
+        cache_path=discovery_cache,
+        unavailable_sites=unavailable_sites,
+    )
 
 
 def update_sites_status(
@@ -401,53 +431,78 @@ def update_sites_status(
 ) -> None:
     """Uodate Devices Status (Including zone)"""
     LOGGER.info("Update Sites Status")
-    for site_id in my_sites_id:
-        try:
-            payload = {}
-            events = api.get_site_history(site_id=site_id)
-            for event in events:
-                if event:
-                    created_at = event.get("createdAt")
-                    date_format = "%Y-%m-%dT%H:%M:%SZ"
-                    created_at_date = datetime.strptime(created_at, date_format)
-                    created_at_date = convert_utc_to_paris(date=created_at_date)
-                    paris_tz = pytz.timezone("Europe/Paris")
-                    now = datetime.now(paris_tz)
-                    if now - created_at_date < timedelta(seconds=90):
-                        if created_at in HISTORY:
-                            LOGGER.info(f"History still published: {HISTORY[created_at]}")
-                            continue
-                        HISTORY[created_at] = {event.get("type"): event.get("label")}
-                        payload = f"{event.get('type')} {event.get('createdAt')} {event.get('label')}"
-                        # Push status to MQTT
-                        mqtt_publish(
-                            mqtt_client=mqtt_client,
-                            topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/history",
-                            payload=payload,
-                            retain=True,
-                        )
-                    else:
-                        LOGGER.info(
-                            f"Event is too old {event.get('type')} {event.get('createdAt')} {event.get('label')}"
-                        )
+    run_per_site(
+        "Update Sites Status",
+        refresh_site_status,
+        my_sites_id,
+        api=api,
+        mqtt_client=mqtt_client,
+        mqtt_config=mqtt_config,
+    )
+
 
+def refresh_site_status(
+    api: MyFoxApi,
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    site_id: str,
+) -> None:
+    """Update Site History and Status"""
+    families = due_families(site_id=site_id, families=["history", "site_status"])
+    if "history" in families:
+        try:
+            events = fetch_new_events(api=api, site_id=site_id)
+            observe(site_id=site_id, family="history", payload=[event for _, event in events])
+            zone = site_zone(api=api, site_id=site_id)
+            published = 0
+            for created_at, event in events:
+                if event_published(site_id=site_id, event=event):
+                    LOGGER.info(f"History still published: {event.get('type')} {event.get('label')}")
+                    advance_history_cursor(site_id=site_id, created_at=created_at)
+                    continue
+                timestamps = event_timestamps(created_at=created_at, zone=zone)
+                event = dict(event, createdAtLocal=timestamps["local"], createdAtUtc=timestamps["utc"])
+                record_site_event(site_id=site_id, event=event)
+                # Push event to MQTT
+                publish_history_event(
+                    mqtt_client=mqtt_client,
+                    mqtt_config=mqtt_config,
+                    site_id=site_id,
+                    event=event,
+                )
+                # Only once published, an event failing to publish is fetched again on next poll
+                remember_event(site_id=site_id, event=event)
+                advance_history_cursor(site_id=site_id, created_at=created_at)
+                published += 1
+            if published:
+                # Something happened on the site, refresh its security level and device states now
+                poll_now(site_id=site_id, family="site_status")
+                poll_now(site_id=site_id, family="state")
+                if "site_status" not in families:
+                    families.append("site_status")
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug(f"History dedup: {history_dedup_metrics()}")
         except Exception as exp:
             LOGGER.warning(f"Error while getting site history: {exp}")
-            continue
 
+    if "site_status" in families:
         try:
             status = api.get_site_status(site_id=site_id)
-            LOGGER.info(f"Update {site_id} Status")
+            observe(site_id=site_id, family="site_status", payload=status.get("payload"))
             # Push status to MQTT
-            mqtt_publish(
+            publish_site_state(
                 mqtt_client=mqtt_client,
-                topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/state",
-                payload={"security_level": ALARM_STATUS.get(status.get("payload").get("statusLabel"), "disarmed")},
-                retain=True,
+                mqtt_config=mqtt_config,
+                site_id=site_id,
+                status=status,
             )
+        except HTTPError as exp:
+            LOGGER.warning(f"Error while refreshing site: {exp}")
+            if exp.response is not None and exp.response.status_code in (403, 404):
+                # Site removed or access revoked, fetch Sites again on next access
+                api.invalidate_sites()
         except Exception as exp:
             LOGGER.warning(f"Error while refreshing site: {exp}")
-            continue
 
 
 def update_devices_status(
@@ -458,64 +513,120 @@ def update_devices_status(
 ) -> None:
     """Update Devices Status (Including zone)"""
     LOGGER.info("Update Devices Status")
-    for site_id in my_sites_id:
-        try:
-            my_devices = api.get_devices(site_id=site_id)
-            temperature_devices = api.get_devices_temperature(site_id=site_id)
-            other_devices = api.get_devices_other(site_id=site_id)
-            light_devices = api.get_devices_light(site_id=site_id)
-            state_devices = api.get_devices_state(site_id=site_id)
+    run_per_site(
+        "Update Devices Status",
+        refresh_site_devices,
+        my_sites_id,
+        api=api,
+        mqtt_client=mqtt_client,
+        mqtt_config=mqtt_config,
+    )
 
-            for device in my_devices:
-                settings = device.settings
 
-                # some device has not global values.
-                if not settings:
-                    continue
+def refresh_site_devices(
+    api: MyFoxApi,
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    site_id: str,
+) -> None:
+    """Update Devices Status of a Site
+
+    Only due endpoints are polled, the others are reused from their last poll.
+    """
+    try:
+        families = due_families(site_id=site_id, families=list(DEVICE_FAMILIES))
+        if not families:
+            return
+        for family, payload in api.get_site_devices_data(site_id=site_id, endpoints=families).items():
+            observe(site_id=site_id, family=family, payload=payload)
+        publish_site_devices(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id)
+    except Exception as exp:
+        LOGGER.warning(f"Error while refreshing devices: {exp}")
+
+
+def publish_site_devices(
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    site_id: str,
+) -> None:
+    """Publish Devices Status of a Site from the last polled payloads"""
+    devices_data = {family: last_payload(site_id=site_id, family=family) for family in DEVICE_FAMILIES}
+    my_devices = devices_data.get("devices") or []
+    temperature_devices = index_by_device_id(devices_data.get("temperature"))
+    other_devices = index_by_device_id(devices_data.get("other"))
+    light_devices = index_by_device_id(devices_data.get("light"))
+    state_devices = index_by_device_id(devices_data.get("state"))
+
+    for device in my_devices:
+        settings = device.settings
+
+        # some device has not global values.
+        if not settings:
+            continue
 
-                keys_values = {}
+        keys_values = {}
 
-                for keys in settings:
-                    for state in settings[keys]:
-                        sensor_name = f"{keys}_{state}"
-                        if keys == "global":
-                            sensor_name = state
+        for keys in settings:
+            for state in settings[keys]:
+                sensor_name = f"{keys}_{state}"
+                if keys == "global":
+                    sensor_name = state
 
-                        keys_values[sensor_name] = settings[keys][state]
+                keys_values[sensor_name] = settings[keys][state]
 
-                # Temperature
-                for temperature_device in temperature_devices:
-                    if temperature_device.get("deviceId") == device.device_id:
-                        keys_values["lastTemperature"] = temperature_device.get("lastTemperature")
+        # Temperature
+        temperature_device = temperature_devices.get(device.device_id)
+        if temperature_device:
+            keys_values["lastTemperature"] = temperature_device.get("lastTemperature")
 
-                # Light
-                for light_device in light_devices:
-                    if light_device.get("deviceId") == device.device_id:
-                        keys_values["light"] = int(light_device.get("light"))
+        # Light
+        light_device = light_devices.get(device.device_id)
+        if light_device:
+            keys_values["light"] = int(light_device.get("light"))
 
-                # State
-                for state_device in state_devices:
-                    if state_device.get("deviceId") == device.device_id:
-                        keys_values["stateLabel"] = state_device.get("stateLabel")
+        # State
+        state_device = state_devices.get(device.device_id)
+        if state_device:
+            keys_values["stateLabel"] = state_device.get("stateLabel")
 
-                # Smoke
-                for other_device in other_devices:
-                    if other_device.get("deviceId") == device.device_id:
-                        keys_values["state"] = other_device.get("state")
+        # Smoke
+        other_device = other_devices.get(device.device_id)
+        if other_device:
+            keys_values["state"] = other_device.get("state")
 
-                payload = {str(key): str(value) for key, value in keys_values.items()}
+        payload = {str(key): str(value) for key, value in keys_values.items()}
+
+        # Push status to MQTT
+        mqtt_publish(
+            mqtt_client=mqtt_client,
+            topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/state",
+            payload=payload,
+            retain=True,
+        )
+
+
+def publish_restored_state(
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    my_sites_id: list,
+) -> None:
+    """Publish the Site and Devices Status restored from the state store (warm restart)
 
-                # Push status to MQTT
-                mqtt_publish(
+    Restored families are only polled after their min interval, their payloads are published meanwhile.
+    """
+    for site_id in my_sites_id:
+        try:
+            status = last_payload(site_id=site_id, family="site_status")
+            if status:
+                publish_site_state(
                     mqtt_client=mqtt_client,
-                    topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/state",
-                    payload=payload,
-                    retain=True,
+                    mqtt_config=mqtt_config,
+                    site_id=site_id,
+                    status={"payload": status},
                 )
-
+            publish_site_devices(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id)
         except Exception as exp:
-            LOGGER.warning(f"Error while refreshing devices: {exp}")
-            continue
+            LOGGER.warning(f"Error while publishing restored state: {exp}")
 
 
 def update_camera_snapshot(
@@ -526,33 +637,40 @@ def update_camera_snapshot(
 ) -> None:
     """Uodate Camera Snapshot"""
     LOGGER.info("Update Camera Snapshot")
-    for site_id in my_sites_id:
-        try:
+    run_per_site(
+        "Update Camera Snapshot",
+        refresh_site_snapshots,
+        my_sites_id,
+        api=api,
+        mqtt_client=mqtt_client,
+        mqtt_config=mqtt_config,
+    )
+
+
+def refresh_site_snapshots(
+    api: MyFoxApi,
+    mqtt_client: MQTTClient,
+    mqtt_config: dict,
+    site_id: str,
+) -> None:
+    """Update Camera Snapshots of a Site"""
+    try:
+        # Snapshots yield to status polling and commands
+        with api.priority(Priority.BACKGROUND):
             for category in [
                 Category.MYFOX_CAMERA,
             ]:
                 my_devices = api.get_devices(site_id=site_id, category=category)
                 for device in my_devices:
-                    response = api.camera_snapshot(site_id=site_id, device_id=device.device_id)
-                    if response.status_code == 200:
-                        # Write image to temp file
-                        path = f"{device.device_id}.jpeg"
-                        with open(path, "wb") as tmp_file:
-                            for chunk in response:
-                                tmp_file.write(chunk)
-                        # Read and Push to MQTT
-                        with open(path, "rb") as tmp_file:
-                            image = tmp_file.read()
-                        byte_arr = bytearray(image)
-                        topic = f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/snapshot"
-                        mqtt_publish(
-                            mqtt_client=mqtt_client,
-                            topic=topic,
-                            payload=byte_arr,
-                            retain=True,
-                            is_json=False,
-                        )
+                    if not snapshot_due(site_id=site_id, device_id=device.device_id, device_label=device.label):
+                        continue
+                    publish_snapshot(
+                        api=api,
+                        mqtt_client=mqtt_client,
+                        mqtt_config=mqtt_config,
+                        site_id=site_id,
+                        device_id=device.device_id,
+                    )
 
-        except Exception as exp:
-            LOGGER.warning(f"Error while refreshing snapshot: {exp}")
-            continue
+    except Exception as exp:
+        LOGGER.warning(f"Error while refreshing snapshot: {exp}")
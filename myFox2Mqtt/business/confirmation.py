@@ -0,0 +1,120 @@
+"""Command Confirmation"""
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONFIRM_TIMEOUT = 20
+DEFAULT_CONFIRM_INITIAL_DELAY = 0.5
+DEFAULT_CONFIRM_MAX_DELAY = 4
+DEFAULT_CONFIRM_WORKERS = 4
+
+# (command, latency, confirmed) of the last commands
+COMMAND_LATENCIES = deque(maxlen=100)
+COMMAND_LATENCIES_LOCK = threading.Lock()
+
+CONFIRM_EXECUTOR = None
+CONFIRM_EXECUTOR_LOCK = threading.Lock()
+
+
+def wait_until_settled(
+    fetch: Callable[[], Any],
+    settled: Callable[[Any], bool],
+    timeout: float = DEFAULT_CONFIRM_TIMEOUT,
+    initial_delay: float = DEFAULT_CONFIRM_INITIAL_DELAY,
+    max_delay: float = DEFAULT_CONFIRM_MAX_DELAY,
+) -> Tuple[Any, bool, float]:
+    """Poll with exponential backoff until the expected state appears or the deadline passes
+
+    Args:
+        fetch (Callable[[], Any]): Read the current state
+        settled (Callable[[Any], bool]): True when the state is the expected one
+        timeout (float, optional): Deadline in seconds. Defaults to DEFAULT_CONFIRM_TIMEOUT.
+        initial_delay (float, optional): First poll delay in seconds. Defaults to DEFAULT_CONFIRM_INITIAL_DELAY.
+        max_delay (float, optional): Max delay between polls in seconds. Defaults to DEFAULT_CONFIRM_MAX_DELAY.
+
+    Returns:
+        Tuple[Any, bool, float]: Last state read (None if none), True if settled, elapsed time
+    """
+    start = monotonic()
+    delay = initial_delay
+    value = None
+    while True:
+        sleep(max(min(delay, timeout - (monotonic() - start)), 0))
+        try:
+            value = fetch()
+            if settled(value):
+                return value, True, monotonic() - start
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.debug(f"Error while polling state: {exp}")
+        if monotonic() - start >= timeout:
+            return value, False, monotonic() - start
+        delay = min(delay * 2, max_delay)
+
+
+def confirm_command(
+    command: str,
+    fetch: Callable[[], Any],
+    settled: Callable[[Any], bool],
+    mqtt_config: Dict,
+) -> Any:
+    """Wait for a command to be applied and record its latency
+
+    Args:
+        command (str): Command name, used in logs
+        fetch (Callable[[], Any]): Read the current state
+        settled (Callable[[Any], bool]): True when the state is the expected one
+        mqtt_config (Dict): MQTT Configuration (confirm_timeout, confirm_initial_delay, confirm_max_delay)
+
+    Returns:
+        Any: Last state read, None if it could not be read
+    """
+    value, confirmed, latency = wait_until_settled(
+        fetch=fetch,
+        settled=settled,
+        timeout=mqtt_config.get("confirm_timeout", DEFAULT_CONFIRM_TIMEOUT),
+        initial_delay=mqtt_config.get("confirm_initial_delay", DEFAULT_CONFIRM_INITIAL_DELAY),
+        max_delay=mqtt_config.get("confirm_max_delay", DEFAULT_CONFIRM_MAX_DELAY),
+    )
+    with COMMAND_LATENCIES_LOCK:
+        COMMAND_LATENCIES.append((command, latency, confirmed))
+    if confirmed:
+        LOGGER.info(f"Command {command} confirmed in {latency:.2f}s")
+    else:
+        LOGGER.warning(f"Command {command} not confirmed after {latency:.2f}s")
+    return value
+
+
+def submit_confirmation(func: Callable[..., None], mqtt_config: Dict, **kwargs: Any) -> Future:
+    """Run a command confirmation in its own pool
+
+    Confirmations poll for up to `confirm_timeout`, running them off the MQTT command workers
+    keeps a command that never settles from delaying the next ones (ie a disarm after an arm).
+
+    Args:
+        func (Callable[..., None]): Confirmation, called with mqtt_config and kwargs
+        mqtt_config (Dict): MQTT Configuration (confirm_workers)
+
+    Returns:
+        Future: Confirmation future
+    """
+    global CONFIRM_EXECUTOR  # pylint: disable=global-statement
+    with CONFIRM_EXECUTOR_LOCK:
+        if CONFIRM_EXECUTOR is None:
+            CONFIRM_EXECUTOR = ThreadPoolExecutor(
+                max_workers=max(int(mqtt_config.get("confirm_workers", DEFAULT_CONFIRM_WORKERS)), 1),
+                thread_name_prefix="myfox-confirm",
+            )
+
+    def run() -> None:
+        try:
+            func(mqtt_config=mqtt_config, **kwargs)
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.warning(f"Error while confirming command: {exp}")
+
+    return CONFIRM_EXECUTOR.submit(run)
@@ -0,0 +1,110 @@
+"""Bridge Diagnostics"""
+
+import logging
+import threading
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Any, Dict, List, Optional
+
+from business.mqtt import mqtt_publish
+from business.polling import DEVICE_FAMILIES, SITE_FAMILIES, polled_at
+from mqtt import MQTTClient
+from utils.metrics import API_ERRORS, API_REQUEST_SECONDS, MQTT_PUBLISHED, SNAPSHOT_BYTES
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIAGNOSTICS_INTERVAL = 60
+
+# Sensor name => Home Assistant sensor settings
+DIAGNOSTIC_SENSORS = {
+    **{f"last_poll_{family}": {"device_class": "timestamp"} for family in list(SITE_FAMILIES) + list(DEVICE_FAMILIES)},
+    "api_latency": {"unit_of_measurement": "ms", "state_class": "measurement"},
+    "api_error_rate": {"unit_of_measurement": "%", "state_class": "measurement"},
+    "command_backlog": {"state_class": "measurement"},
+    "mqtt_publish_rate": {"unit_of_measurement": "msg/min", "state_class": "measurement"},
+    "snapshot_rate": {"unit_of_measurement": "kB/h", "state_class": "measurement"},
+}
+
+DIAGNOSTICS_CONFIG = {}
+DIAGNOSTICS_LOCK = threading.Lock()
+# Metric totals at the start of the current window
+DIAGNOSTICS_BASELINE = {}
+
+
+def _totals() -> Dict[str, float]:
+    count, latency = API_REQUEST_SECONDS.total()
+    return {
+        "time": monotonic(),
+        "requests": count,
+        "latency": latency,
+        "errors": API_ERRORS.total(),
+        "published": MQTT_PUBLISHED.total(),
+        "snapshot_bytes": SNAPSHOT_BYTES.total(),
+    }
+
+
+def init_diagnostics(config: Optional[Dict]) -> None:
+    """Init Diagnostics settings
+
+    Args:
+        config (Optional[Dict]): Diagnostics Configuration (enabled, interval)
+    """
+    DIAGNOSTICS_CONFIG.clear()
+    DIAGNOSTICS_CONFIG.update(config or {})
+    with DIAGNOSTICS_LOCK:
+        DIAGNOSTICS_BASELINE.clear()
+        DIAGNOSTICS_BASELINE.update(_totals())
+
+
+def diagnostics_enabled() -> bool:
+    """Diagnostics sensors are published unless `diagnostics.enabled` is false"""
+    return bool(DIAGNOSTICS_CONFIG.get("enabled", True))
+
+
+def diagnostics_interval() -> int:
+    """Seconds between diagnostics publishes"""
+    return max(int(DIAGNOSTICS_CONFIG.get("interval", DEFAULT_DIAGNOSTICS_INTERVAL)), 10)
+
+
+def window_stats() -> Dict[str, Any]:
+    """Bridge statistics since the previous call
+
+    Returns:
+        Dict[str, Any]: api_latency (ms), api_error_rate (%), mqtt_publish_rate (msg/min), snapshot_rate (kB/h)
+    """
+    totals = _totals()
+    with DIAGNOSTICS_LOCK:
+        baseline = dict(DIAGNOSTICS_BASELINE) or totals
+        DIAGNOSTICS_BASELINE.clear()
+        DIAGNOSTICS_BASELINE.update(totals)
+    elapsed = max(totals["time"] - baseline["time"], 1e-3)
+    requests = totals["requests"] - baseline["requests"]
+    return {
+        "api_latency": round((totals["latency"] - baseline["latency"]) / requests * 1000) if requests else None,
+        "api_error_rate": round((totals["errors"] - baseline["errors"]) / requests * 100, 1) if requests else None,
+        "mqtt_publish_rate": round((totals["published"] - baseline["published"]) / elapsed * 60, 1),
+        "snapshot_rate": round((totals["snapshot_bytes"] - baseline["snapshot_bytes"]) / elapsed * 3600 / 1024, 1),
+    }
+
+
+def publish_diagnostics(mqtt_client: MQTTClient, mqtt_config: dict, my_sites_id: List[str], **_: Any) -> None:
+    """Publish the bridge diagnostics of each Site
+
+    Args:
+        mqtt_client (MQTTClient): MQTTClient
+        mqtt_config (dict): MQTT Configuration
+        my_sites_id (List[str]): Sites ID
+    """
+    stats = window_stats()
+    stats["command_backlog"] = mqtt_client.dispatcher.depth()
+    for site_id in my_sites_id:
+        payload = dict(stats)
+        payload.update({name: None for name in DIAGNOSTIC_SENSORS if name.startswith("last_poll_")})
+        for family, polled in polled_at(site_id=site_id).items():
+            payload[f"last_poll_{family}"] = datetime.fromtimestamp(polled, timezone.utc).isoformat()
+        mqtt_publish(
+            mqtt_client=mqtt_client,
+            topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/diagnostics",
+            payload=payload,
+            retain=True,
+        )
@@ -0,0 +1,355 @@
+"""Site History"""
+
+import hashlib
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, tzinfo
+from functools import lru_cache
+from time import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytz
+
+from myfox.api import MyFoxApi
+from utils.metrics import Gauge
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DEDUP_TTL = 24 * 3600
+DEFAULT_DEDUP_MAX_ENTRIES = 10000
+DEFAULT_MAX_AGE = 90
+DEFAULT_MAX_PAGES = 5
+EVENT_ID_KEYS = ("logId", "eventId", "id")
+CREATED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DEFAULT_TIMEZONE = "Europe/Paris"
+
+HISTORY_CONFIG = {}
+HISTORY_LOCK = threading.Lock()
+# site_id => createdAt (epoch) of the newest event handled
+HISTORY_CURSORS = {}
+
+
+def event_identity(site_id: str, event: Dict) -> str:
+    """Stable identity of a history event
+
+    The API event ID is used when present, otherwise a digest of the event content,
+    so two events sharing a timestamp don't collide.
+
+    Args:
+        site_id (str): Site ID
+        event (Dict): History event
+
+    Returns:
+        str: Event identity
+    """
+    for key in EVENT_ID_KEYS:
+        if event.get(key):
+            return f"{site_id}:{event[key]}"
+    content = "\x1f".join(
+        str(event.get(key, "")) for key in ("createdAt", "type", "label", "deviceId", "userId")
+    ).encode("utf8")
+    return f"{site_id}:{hashlib.blake2b(content, digest_size=12).hexdigest()}"
+
+
+class EventDedup:
+    """Bounded set of already published events, evicted after a TTL or once full (oldest first)"""
+
+    def __init__(self, ttl: float = DEFAULT_DEDUP_TTL, max_entries: int = DEFAULT_DEDUP_MAX_ENTRIES):
+        """Init EventDedup
+
+        Args:
+            ttl (float, optional): Seconds an event is remembered. Defaults to DEFAULT_DEDUP_TTL.
+            max_entries (int, optional): Max remembered events. Defaults to DEFAULT_DEDUP_MAX_ENTRIES.
+        """
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.lock = threading.Lock()
+        # identity => expiry (epoch), in insertion order
+        self.entries = OrderedDict()  # type: OrderedDict[str, float]
+        self.hits = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self, now: float) -> None:
+        while self.entries:
+            identity, expire_at = next(iter(self.entries.items()))
+            if expire_at > now:
+                break
+            del self.entries[identity]
+            self.expired += 1
+
+    def seen(self, identity: str, remember: bool = True) -> bool:
+        """Check if an event was already seen, and remember it
+
+        Args:
+            identity (str): Event identity
+            remember (bool, optional): Remember the event if not seen yet. Defaults to True.
+
+        Returns:
+            bool: True if the event was already seen
+        """
+        now = time()
+        with self.lock:
+            self._expire(now)
+            if identity in self.entries:
+                self.hits += 1
+                return True
+            if not remember:
+                return False
+            self.entries[identity] = now + self.ttl
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+            return False
+
+    def export(self) -> Dict[str, float]:
+        """Remembered events, JSON serializable
+
+        Returns:
+            Dict[str, float]: Expiry by identity
+        """
+        with self.lock:
+            self._expire(time())
+            return dict(self.entries)
+
+    def load(self, entries: Dict[str, float]) -> None:
+        """Restore remembered events
+
+        Args:
+            entries (Dict[str, float]): Expiry by identity
+        """
+        now = time()
+        with self.lock:
+            for identity, expire_at in sorted(entries.items(), key=lambda item: item[1]):
+                if float(expire_at) > now:
+                    self.entries[identity] = float(expire_at)
+                    self.entries.move_to_end(identity)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Size and memory use
+
+        Returns:
+            Dict[str, Any]: entries, approximate bytes, hits, expired, evicted
+        """
+        with self.lock:
+            size = sys.getsizeof(self.entries) + sum(
+                sys.getsizeof(identity) + sys.getsizeof(expire_at) for identity, expire_at in self.entries.items()
+            )
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": size,
+                "hits": self.hits,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+HISTORY_DEDUP = EventDedup()
+
+
+def init_history(config: Optional[Dict]) -> None:
+    """Init History settings
+
+    Args:
+        config (Optional[Dict]): History Configuration
+    """
+    global HISTORY_DEDUP  # pylint: disable=global-statement
+    HISTORY_CONFIG.clear()
+    HISTORY_CONFIG.update(config or {})
+    HISTORY_DEDUP = EventDedup(
+        ttl=float(HISTORY_CONFIG.get("dedup_ttl", DEFAULT_DEDUP_TTL)),
+        max_entries=int(HISTORY_CONFIG.get("dedup_max_entries", DEFAULT_DEDUP_MAX_ENTRIES)),
+    )
+
+
+@lru_cache(maxsize=1024)
+def parse_created_at(created_at: str) -> float:
+    """Parse an event createdAt (UTC), cached as the same events come back on every poll
+
+    Args:
+        created_at (str): Event createdAt, ie 2022-01-31T12:00:00Z
+
+    Returns:
+        float: Epoch
+    """
+    return datetime.strptime(created_at, CREATED_AT_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+@lru_cache(maxsize=64)
+def get_zone(name: str) -> tzinfo:
+    """Get a timezone by name, built once
+
+    Args:
+        name (str): Timezone name, ie Europe/Paris
+
+    Returns:
+        tzinfo: Timezone, the default one if unknown
+    """
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        LOGGER.warning(f"Unknown timezone {name}, using {DEFAULT_TIMEZONE}")
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def site_zone(api: MyFoxApi, site_id: str) -> tzinfo:
+    """Timezone of a Site, from the Site registry
+
+    Args:
+        api (MyFoxApi): MyFoxApi
+        site_id (str): Site ID
+
+    Returns:
+        tzinfo: Timezone, `history.default_timezone` if the Site has none
+    """
+    site = api.get_cached_site(site_id)
+    return get_zone(getattr(site, "timezone", None) or HISTORY_CONFIG.get("default_timezone", DEFAULT_TIMEZONE))
+
+
+def event_timestamps(created_at: float, zone: tzinfo) -> Dict[str, str]:
+    """ISO-8601 timestamps of an event, with offset
+
+    Args:
+        created_at (float): Event createdAt (epoch)
+        zone (tzinfo): Site timezone
+
+    Returns:
+        Dict[str, str]: "local" (Site timezone) and "utc" timestamps
+    """
+    utc_date = datetime.fromtimestamp(created_at, timezone.utc)
+    return {"local": utc_date.astimezone(zone).isoformat(), "utc": utc_date.isoformat()}
+
+
+def history_cursor(site_id: str) -> Optional[float]:
+    """createdAt (epoch) of the newest event handled for a Site, None before the first poll"""
+    with HISTORY_LOCK:
+        return HISTORY_CURSORS.get(site_id)
+
+
+def advance_history_cursor(site_id: str, created_at: float) -> None:
+    """Move the cursor of a Site forward"""
+    with HISTORY_LOCK:
+        HISTORY_CURSORS[site_id] = max(HISTORY_CURSORS.get(site_id, created_at), created_at)
+
+
+def export_history_cursors() -> Dict[str, float]:
+    """Cursors by Site ID"""
+    with HISTORY_LOCK:
+        return dict(HISTORY_CURSORS)
+
+
+def load_history_cursors(cursors: Dict[str, float]) -> None:
+    """Restore cursors by Site ID"""
+    with HISTORY_LOCK:
+        HISTORY_CURSORS.update({site_id: float(cursor) for site_id, cursor in cursors.items()})
+
+
+def fetch_new_events(api: MyFoxApi, site_id: str) -> List[Tuple[float, Dict]]:
+    """Fetch the events of a Site since its cursor, oldest first
+
+    Pages are fetched until one reaches the cursor, so events are caught up after a downtime
+    (up to `history.max_pages`). Without cursor (first poll ever), only events younger than
+    `history.max_age` seconds are returned. The caller advances the cursor once each event is
+    handled (see advance_history_cursor), so events are fetched again if publishing fails.
+
+    Args:
+        api (MyFoxApi): MyFoxApi
+        site_id (str): Site ID
+
+    Returns:
+        List[Tuple[float, Dict]]: (createdAt epoch, event)
+    """
+    cursor = history_cursor(site_id)
+    if cursor is None:
+        since = time() - float(HISTORY_CONFIG.get("max_age", DEFAULT_MAX_AGE))
+        max_pages = 1
+    else:
+        # Events sharing the cursor timestamp are filtered by the dedup
+        since = cursor
+        max_pages = max(int(HISTORY_CONFIG.get("max_pages", DEFAULT_MAX_PAGES)), 1)
+
+    events = []
+    offset = 0
+    first_page = None
+    pages = 0
+    reached = False
+    # No older event on the API side
+    exhausted = False
+    while pages < max_pages:
+        page = [event for event in api.get_site_history(site_id=site_id, offset=offset) or [] if event]
+        if not page:
+            exhausted = True
+            break
+        if page == first_page:
+            # Pagination not honoured
+            break
+        pages += 1
+        first_page = first_page or page
+        for event in page:
+            created_at = parse_created_at(event.get("createdAt"))
+            if created_at < since:
+                reached = True
+                continue
+            events.append((created_at, event))
+        if reached:
+            break
+        if len(page) < len(first_page):
+            exhausted = True
+            break
+        offset += len(page)
+    if cursor is not None and not reached and not exhausted:
+        LOGGER.warning(
+            f"History of site {site_id}: last poll not reached after {pages} page(s), older events may be lost"
+        )
+
+    events.sort(key=lambda item: item[0])
+    if not events and cursor is None:
+        advance_history_cursor(site_id=site_id, created_at=since)
+    return events
+
+
+def event_published(site_id: str, event: Dict) -> bool:
+    """Check if a history event was already published
+
+    Args:
+        site_id (str): Site ID
+        event (Dict): History event
+
+    Returns:
+        bool: True if the event was already published
+    """
+    return HISTORY_DEDUP.seen(event_identity(site_id=site_id, event=event), remember=False)
+
+
+def remember_event(site_id: str, event: Dict) -> None:
+    """Remember a published history event
+
+    Args:
+        site_id (str): Site ID
+        event (Dict): History event
+    """
+    HISTORY_DEDUP.seen(event_identity(site_id=site_id, event=event))
+
+
+def export_history_dedup() -> Dict[str, float]:
+    """Published events, see EventDedup.export"""
+    return HISTORY_DEDUP.export()
+
+
+def load_history_dedup(entries: Dict[str, float]) -> None:
+    """Restore published events, see EventDedup.load"""
+    HISTORY_DEDUP.load(entries)
+
+
+def history_dedup_metrics() -> Dict[str, Any]:
+    """History dedup size and memory use, see EventDedup.metrics"""
+    return HISTORY_DEDUP.metrics()
+
+
+HISTORY_DEDUP_BYTES = Gauge("myfox_history_dedup_bytes", "Approximate memory used by published history events")
+HISTORY_DEDUP_BYTES.set_function(lambda: history_dedup_metrics()["bytes"])
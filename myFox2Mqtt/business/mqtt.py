@@ -1,43 +1,263 @@
 """ MQTT Business"""
 
-import json
+import hashlib
 import logging
-from time import sleep
+import threading
+from time import monotonic
+from typing import Dict
 
+from business.confirmation import confirm_command, submit_confirmation
+from business.polling import poll_now
+from business.snapshot import (
+    fetch_snapshot,
+    record_site_security,
+    save_snapshot,
+    snapshot_changed,
+    submit_variants,
+)
 from homeassistant.ha_discovery import ALARM_STATUS
 from paho.mqtt import client
 from myfox.api import MyFoxApi, ACTION_LIST
+from utils.codec import dumps
+from utils.metrics import MQTT_PUBLISHED, MQTT_PUBLISHED_BYTES, MQTT_SKIPPED, SNAPSHOT_BYTES
 
 LOGGER = logging.getLogger(__name__)
 SUBSCRIBE_TOPICS = []
 
+# Actions changing the device settings, others (reboot, siren, tests...) are confirmed by the first read
+STATEFUL_ACTIONS = (
+    "shutter_open",
+    "shutter_close",
+    "garage_open",
+    "garage_close",
+    "gate_open",
+    "gate_close",
+    "light_on",
+    "light_off",
+    "rolling_shutter_up",
+    "rolling_shutter_down",
+)
 
-def mqtt_publish(mqtt_client, topic, payload, qos=0, retain=True, is_json=True):
-    """MQTT publish"""
+DEFAULT_REPUBLISH_INTERVAL = 3600
+# topic => (payload digest, last publish time)
+PUBLISH_CACHE = {}
+PUBLISH_CACHE_LOCK = threading.Lock()
+# Discovery topic => config, published again on (re)connect and when Home Assistant comes online
+DISCOVERY_CONFIGS = {}
+DISCOVERY_LOCK = threading.Lock()
+
+
+def clear_publish_cache() -> None:
+    """Forget published payloads, next publish of each topic will be sent"""
+    with PUBLISH_CACHE_LOCK:
+        PUBLISH_CACHE.clear()
+
+
+def publish_needed(mqtt_client, topic: str, payload) -> bool:
+    """Check if a retained payload differs from the last one published on this topic
+
+    Identical payloads are still republished every `republish_interval` seconds (0 disables the cache).
+
+    Args:
+        mqtt_client (MQTTClient): MQTTClient
+        topic (str): Topic
+        payload (Union[str, bytes, bytearray]): Encoded payload
+
+    Returns:
+        bool: True if the payload must be published
+    """
+    republish_interval = mqtt_client.config.get("republish_interval", DEFAULT_REPUBLISH_INTERVAL)
+    if not republish_interval:
+        return True
+    if isinstance(payload, str):
+        payload = payload.encode("utf8")
+    digest = hashlib.blake2b(payload, digest_size=16).digest()
+    now = monotonic()
+    with PUBLISH_CACHE_LOCK:
+        cached = PUBLISH_CACHE.get(topic)
+        if cached and cached[0] == digest and now - cached[1] < republish_interval:
+            return False
+        PUBLISH_CACHE[topic] = (digest, now)
+    return True
+
+
+def mqtt_publish(mqtt_client, topic, payload, qos=0, retain=True, is_json=True, force=False):
+    """MQTT publish
+
+    Retained payloads identical to the last one published on the same topic are skipped, unless forced.
+    Returns the paho MQTTMessageInfo, None if skipped.
+    """
     if is_json:
-        payload = json.dumps(payload, ensure_ascii=False).encode("utf8")
-    mqtt_client.client.publish(topic, payload, qos=qos, retain=retain)
+        payload = dumps(payload)
+    if retain and not force and not publish_needed(mqtt_client, topic, payload):
+        LOGGER.debug(f"Unchanged payload on {topic}, not published")
+        MQTT_SKIPPED.inc()
+        return None
+    info = mqtt_client.client.publish(topic, payload, qos=qos, retain=retain)
+    MQTT_PUBLISHED.inc(retained=str(retain).lower())
+    MQTT_PUBLISHED_BYTES.inc(
+        len(payload) if isinstance(payload, (bytes, bytearray)) else len(str(payload)), retained=str(retain).lower()
+    )
+    return info
 
 
-def update_device(api, mqtt_client, mqtt_config, site_id, device_id):
-    """Update MQTT data for a device"""
-    LOGGER.info(f"Live Update device {device_id}")
-    try:
-        device = api.get_device(site_id=site_id, device_id=device_id)
-        settings = device.settings
+def remember_discovery_config(topic: str, config: Dict) -> None:
+    """Remember a discovery config already published, see republish_discovery
+
+    Args:
+        topic (str): Discovery topic
+        config (Dict): Discovery config
+    """
+    with DISCOVERY_LOCK:
+        DISCOVERY_CONFIGS[topic] = config
+
+
+def publish_discovery_config(mqtt_client, topic: str, config: Dict) -> bool:
+    """Publish a discovery config (QoS 1, retained), remembered to be published again by republish_discovery
+
+    Args:
+        mqtt_client (MQTTClient): MQTTClient
+        topic (str): Discovery topic
+        config (Dict): Discovery config
+
+    Returns:
+        bool: True if the message was accepted by the client
+    """
+    remember_discovery_config(topic=topic, config=config)
+    info = mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=config, qos=1, retain=True, force=True)
+    return info is not None and info.rc == client.MQTT_ERR_SUCCESS
+
+
+def remove_discovery_config(mqtt_client, topic: str) -> bool:
+    """Remove a discovery config (empty retained payload, QoS 1)
+
+    Args:
+        mqtt_client (MQTTClient): MQTTClient
+        topic (str): Discovery topic
+
+    Returns:
+        bool: True if the message was accepted by the client
+    """
+    with DISCOVERY_LOCK:
+        DISCOVERY_CONFIGS.pop(topic, None)
+    info = mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload="", qos=1, retain=True, is_json=False, force=True)
+    return info is not None and info.rc == client.MQTT_ERR_SUCCESS
+
+
+def republish_discovery(mqtt_client) -> None:
+    """Publish every known discovery config again, the broker or Home Assistant may have lost them"""
+    with DISCOVERY_LOCK:
+        configs = dict(DISCOVERY_CONFIGS)
+    if not configs:
+        return
+    LOGGER.info(f"Discovery: publishing {len(configs)} config(s) again")
+    for topic, config in configs.items():
+        mqtt_publish(mqtt_client=mqtt_client, topic=topic, payload=config, qos=1, retain=True, force=True)
+
+
+def publish_device_state(mqtt_client, mqtt_config, site_id, device):
+    """Push device settings to MQTT"""
+    settings = device.settings
+
+    # Convert Values to String
+    keys_values = settings.items()
+    payload = {str(key): str(value) for key, value in keys_values}
+    # Push status to MQTT
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/state",
+        payload=payload,
+        retain=True,
+    )
+
+
+def publish_history_event(mqtt_client, mqtt_config, site_id, event):
+    """Push a history event to MQTT
+
+    Each event is sent as JSON on the non retained `history/events` stream, so bursts are not lost,
+    the retained `history` topic keeps the last event.
+    """
+    topic = f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/history"
+    if mqtt_config.get("history_events", True):
+        mqtt_publish(
+            mqtt_client=mqtt_client,
+            topic=f"{topic}/events",
+            payload={
+                "site_id": site_id,
+                "device_id": event.get("deviceId"),
+                "type": event.get("type"),
+                "label": event.get("label"),
+                "created_at": event.get("createdAtUtc", event.get("createdAt")),
+                "created_at_local": event.get("createdAtLocal"),
+            },
+            qos=int(mqtt_config.get("history_events_qos", 1)),
+            retain=False,
+        )
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=topic,
+        payload=f"{event.get('type')} {event.get('createdAtLocal', event.get('createdAt'))} {event.get('label')}",
+        retain=True,
+    )
+
+
+def publish_site_state(mqtt_client, mqtt_config, site_id, status):
+    """Push site security level to MQTT"""
+    LOGGER.info(f"Update {site_id} Status")
+    record_site_security(site_id=site_id, security_level=status.get("payload").get("statusLabel"))
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/state",
+        payload={"security_level": ALARM_STATUS.get(status.get("payload").get("statusLabel"), "disarmed")},
+        retain=True,
+    )
+
 
-        # Convert Values to String
-        keys_values = settings.items()
-        payload = {str(key): str(value) for key, value in keys_values}
-        # Push status to MQTT
+def publish_snapshot(api, mqtt_client, mqtt_config, site_id, device_id, dedup=True):
+    """Take a Camera Snapshot and push it to MQTT, without disk round trip
+
+    With dedup, a snapshot identical to the last one of this camera is not published.
+    """
+    image = fetch_snapshot(api=api, site_id=site_id, device_id=device_id)
+    if image is None:
+        return None
+    SNAPSHOT_BYTES.inc(len(image))
+    if not snapshot_changed(device_id=device_id, image=image) and dedup:
+        LOGGER.info(f"Snapshot of {device_id} unchanged")
+        return image
+    topic = f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device_id}/snapshot"
+    mqtt_publish(
+        mqtt_client=mqtt_client,
+        topic=topic,
+        payload=image,
+        retain=True,
+        is_json=False,
+        force=not dedup,
+    )
+    save_snapshot(device_id=device_id, image=image)
+
+    def publish_variant(name, variant_image):
         mqtt_publish(
             mqtt_client=mqtt_client,
-            topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/state",
-            payload=payload,
+            topic=f"{topic}_{name}",
+            payload=variant_image,
             retain=True,
+            is_json=False,
+            force=not dedup,
         )
+
+    submit_variants(image=image, publish=publish_variant)
+    return image
+
+
+def update_device(api, mqtt_client, mqtt_config, site_id, device_id):
+    """Update MQTT data for a device"""
+    LOGGER.info(f"Live Update device {device_id}")
+    try:
+        device = api.get_device(site_id=site_id, device_id=device_id)
+        publish_device_state(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id, device=device)
     except Exception as exp:
-        LOGGER.warning(f"Error while refreshing {device.label}: {exp}")
+        LOGGER.warning(f"Error while refreshing device {device_id}: {exp}")
 
 
 def update_site(api, mqtt_client, mqtt_config, site_id):
@@ -45,18 +265,50 @@ def update_site(api, mqtt_client, mqtt_config, site_id):
     LOGGER.info(f"Live Update site {site_id}")
     try:
         status = api.get_site_status(site_id=site_id)
-        LOGGER.info(f"Update {site_id} Status")
-        # Push status to MQTT
-        mqtt_publish(
-            mqtt_client=mqtt_client,
-            topic=f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/state",
-            payload={"security_level": ALARM_STATUS.get(status.get("payload").get("statusLabel"), "disarmed")},
-            retain=True,
-        )
+        publish_site_state(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id, status=status)
     except Exception as exp:
         LOGGER.warning(f"Error while refreshing site {site_id}: {exp}")
 
 
+def confirm_site(api, mqtt_client, mqtt_config, site_id, security_level):
+    """Wait for a site security level, then update MQTT data"""
+    status = confirm_command(
+        command=f"{site_id} {security_level}",
+        fetch=lambda: api.get_site_status(site_id=site_id),
+        settled=lambda status: status.get("payload").get("statusLabel") == security_level,
+        mqtt_config=mqtt_config,
+    )
+    # Site is changing, poll it closely
+    poll_now(site_id=site_id, family="site_status")
+    if status is None:
+        update_site(api=api, mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id)
+        return
+    publish_site_state(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id, status=status)
+
+
+def device_settings(api, site_id, device_id):
+    """Settings of a device before a command, read from the API (the last poll may be minutes old)"""
+    try:
+        return api.get_device(site_id=site_id, device_id=device_id).settings
+    except Exception as exp:
+        LOGGER.warning(f"Unable to read device {device_id} before command: {exp}")
+        return None
+
+
+def confirm_device(api, mqtt_client, mqtt_config, site_id, device_id, command, settled):
+    """Wait for a device to be updated, then update MQTT data"""
+    device = confirm_command(
+        command=f"{device_id} {command}",
+        fetch=lambda: api.get_device(site_id=site_id, device_id=device_id),
+        settled=settled,
+        mqtt_config=mqtt_config,
+    )
+    if device is None:
+        update_device(api=api, mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id, device_id=device_id)
+        return
+    publish_device_state(mqtt_client=mqtt_client, mqtt_config=mqtt_config, site_id=site_id, device=device)
+
+
 def consume_mqtt_message(msg, mqtt_config: dict, api: MyFoxApi, mqtt_client: client):
     """Compute MQTT received message"""
     try:
@@ -79,13 +331,14 @@ def consume_mqtt_message(msg, mqtt_config: dict, api: MyFoxApi, mqtt_client: cli
                 LOGGER.warning(f"Unable to reteive Site ID: {site_id}: {exp}")
             # Update Alarm via API
             api.update_security_level(site_id=site_id, security_level=text_payload)
-            # Read updated Alarm Status
-            sleep(2)
-            update_site(
+            # Read updated Alarm Status, off the command worker
+            submit_confirmation(
+                confirm_site,
                 api=api,
                 mqtt_client=mqtt_client,
                 mqtt_config=mqtt_config,
                 site_id=site_id,
+                security_level=text_payload,
             )
 
         # Manage Shutter
@@ -135,20 +388,25 @@ def consume_mqtt_message(msg, mqtt_config: dict, api: MyFoxApi, mqtt_client: cli
             device_id = msg.topic.split("/")[2]
             if device_id:
                 LOGGER.info(f"Message received for Site ID: {site_id}, Device ID: {device_id}, Action: {text_payload}")
+                before = None
+                if text_payload in STATEFUL_ACTIONS:
+                    before = device_settings(api=api, site_id=site_id, device_id=device_id)
                 action_device = api.action_device(
                     site_id=site_id,
                     device_id=device_id,
                     action=text_payload,
                 )
                 LOGGER.debug(action_device)
-                # Read updated device
-                sleep(2)
-                update_device(
+                # Read updated device, stateful actions wait for a change from the state read before the command
+                submit_confirmation(
+                    confirm_device,
                     api=api,
                     mqtt_client=mqtt_client,
                     mqtt_config=mqtt_config,
                     site_id=site_id,
                     device_id=device_id,
+                    command=text_payload,
+                    settled=lambda device: before is None or device.settings != before,
                 )
             else:
                 LOGGER.info(f"Message received for Site ID: {site_id}, Action: {text_payload}")
@@ -157,27 +415,17 @@ def consume_mqtt_message(msg, mqtt_config: dict, api: MyFoxApi, mqtt_client: cli
         elif msg.topic.split("/")[3] == "snapshot":
             site_id = msg.topic.split("/")[1]
             device_id = msg.topic.split("/")[2]
-            if text_payload == "True":
+            # Payload is lowered
+            if text_payload == "true":
                 LOGGER.info("Manual Snapshot")
-                response = api.camera_snapshot(site_id=site_id, device_id=device_id)
-                if response.status_code == 200:
-                    # Write image to temp file
-                    path = f"{device_id}.jpeg"
-                    with open(path, "wb") as snapshot_file:
-                        for chunk in response:
-                            snapshot_file.write(chunk)
-                    # Read and Push to MQTT
-                    snapshot_file = open(path, "rb")
-                    image = snapshot_file.read()
-                    byte_array = bytearray(image)
-                    topic = f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device_id}/snapshot"
-                    mqtt_publish(
-                        mqtt_client,
-                        topic,
-                        byte_array,
-                        retain=True,
-                        is_json=False,
-                    )
+                publish_snapshot(
+                    api=api,
+                    mqtt_client=mqtt_client,
+                    mqtt_config=mqtt_config,
+                    site_id=site_id,
+                    device_id=device_id,
+                    dedup=False,
+                )
 
         # Manage Settings update
         else:
@@ -195,13 +443,15 @@ def consume_mqtt_message(msg, mqtt_config: dict, api: MyFoxApi, mqtt_client: cli
                 settings=settings,
             )
             # Read updated device
-            sleep(2)
-            update_device(
+            submit_confirmation(
+                confirm_device,
                 api=api,
                 mqtt_client=mqtt_client,
                 mqtt_config=mqtt_config,
                 site_id=site_id,
                 device_id=device_id,
+                command=f"{setting}={text_payload}",
+                settled=lambda device: str(device.settings.get("global", {}).get(setting)).lower() == str(text_payload),
             )
 
     except Exception as exp:
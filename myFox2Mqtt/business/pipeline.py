@@ -0,0 +1,67 @@
+"""Per Site Refresh Pipeline"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Dict, List
+
+from utils.metrics import REFRESH_CYCLE_SECONDS, SITE_REFRESH_SECONDS
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SITE_WORKERS = 4
+SITE_EXECUTOR = None
+SITE_EXECUTOR_LOCK = threading.Lock()
+
+
+def init_site_pool(max_workers: int = DEFAULT_SITE_WORKERS) -> None:
+    """Init the pool used to refresh Sites in parallel
+
+    Args:
+        max_workers (int, optional): Max Sites refreshed at the same time. Defaults to DEFAULT_SITE_WORKERS.
+    """
+    global SITE_EXECUTOR  # pylint: disable=global-statement
+    with SITE_EXECUTOR_LOCK:
+        if SITE_EXECUTOR is not None:
+            SITE_EXECUTOR.shutdown(wait=False)
+        SITE_EXECUTOR = ThreadPoolExecutor(max_workers=max(int(max_workers), 1), thread_name_prefix="myfox-site")
+
+
+def _timed(label: str, func: Callable, site_id: str, **kwargs) -> float:
+    """Run func for one Site, isolating its errors
+
+    Returns:
+        float: Elapsed time in seconds
+    """
+    start = monotonic()
+    try:
+        func(site_id=site_id, **kwargs)
+    except Exception as exp:  # pylint: disable=broad-except
+        LOGGER.warning(f"{label} failed for site {site_id}: {exp}")
+    elapsed = monotonic() - start
+    SITE_REFRESH_SECONDS.observe(elapsed, job=func.__name__)
+    LOGGER.info(f"{label} for site {site_id} done in {elapsed:.2f}s")
+    return elapsed
+
+
+def run_per_site(label: str, func: Callable, my_sites_id: List[str], **kwargs) -> Dict[str, float]:
+    """Run a per Site refresh on every Site in parallel
+
+    Args:
+        label (str): Refresh name, used in logs
+        func (Callable): Per Site refresh, called with site_id and kwargs
+        my_sites_id (List[str]): Sites ID
+
+    Returns:
+        Dict[str, float]: Elapsed time by Site ID
+    """
+    if SITE_EXECUTOR is None:
+        init_site_pool()
+    start = monotonic()
+    futures = {site_id: SITE_EXECUTOR.submit(_timed, label, func, site_id, **kwargs) for site_id in my_sites_id}
+    timings = {site_id: future.result() for site_id, future in futures.items()}
+    elapsed = monotonic() - start
+    REFRESH_CYCLE_SECONDS.observe(elapsed, job=func.__name__)
+    LOGGER.info(f"{label} for {len(timings)} site(s) done in {elapsed:.2f}s")
+    return timings
@@ -0,0 +1,214 @@
+"""Adaptive Polling"""
+
+import hashlib
+import logging
+import threading
+from time import monotonic, time
+from typing import Any, Dict, List, Optional
+
+from utils.codec import dumps, loads
+
+LOGGER = logging.getLogger(__name__)
+
+MIN_INTERVAL = 10
+DEFAULT_FACTOR = 2
+
+# Family => default max interval in seconds (None: same as min), min interval defaults to delay_site / delay_device
+# Security level and doors / motion states must not lag, they only back off when configured
+SITE_FAMILIES = {
+    "site_status": None,
+    # Events must not lag, missed ones are caught up from the history cursor (see business.history)
+    "history": None,
+}
+DEVICE_FAMILIES = {
+    # Device settings feed every device state topic and command confirmations
+    "devices": None,
+    "state": None,
+    "other": 1800,
+    "temperature": 1800,
+    "light": 1800,
+}
+
+POLLING_LOCK = threading.Lock()
+# family => {"min": .., "max": .., "factor": ..}
+POLLING_BOUNDS = {}
+# (site_id, family) => AdaptiveInterval
+INTERVALS = {}
+# (site_id, family) => last successful poll (epoch)
+POLLED_AT = {}
+
+
+def _serialize(obj: Any) -> Any:
+    """JSON fallback for model objects (Device, Site)"""
+    if hasattr(obj, "__slots__"):
+        return {slot: getattr(obj, slot, None) for slot in obj.__slots__}
+    return str(obj)
+
+
+class AdaptiveInterval:
+    """Polling interval of an endpoint family for a Site
+
+    Shortened to its min after an observed change, backs off exponentially up to its max
+    while the value stays the same.
+    """
+
+    __slots__ = ("minimum", "maximum", "factor", "interval", "next_at", "digest", "payload")
+
+    def __init__(self, minimum: float, maximum: float, factor: float = DEFAULT_FACTOR):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = minimum
+        self.next_at = 0.0
+        self.digest = None
+        self.payload = None
+
+    def due(self, now: float) -> bool:
+        """Check if the family must be polled"""
+        # Tolerate scheduler jitter
+        return now >= self.next_at - 1
+
+    def observe(self, payload: Any, now: float) -> bool:
+        """Record a polled payload and compute the next poll
+
+        Returns:
+            bool: True if the payload changed
+        """
+        digest = hashlib.blake2b(
+            dumps(payload, sort_keys=True, default=_serialize),
+            digest_size=16,
+        ).digest()
+        changed = digest != self.digest
+        if changed:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.interval * self.factor, self.maximum)
+        self.digest = digest
+        self.payload = payload
+        self.next_at = now + self.interval
+        return changed
+
+
+def init_polling(config: Optional[Dict], delay_site: int, delay_device: int) -> None:
+    """Init polling bounds
+
+    Args:
+        config (Optional[Dict]): Polling Configuration, bounds by family
+        delay_site (int): Default min interval of site families
+        delay_device (int): Default min interval of device families
+    """
+    config = config or {}
+    with POLLING_LOCK:
+        POLLING_BOUNDS.clear()
+        INTERVALS.clear()
+        for families, delay in ((SITE_FAMILIES, delay_site), (DEVICE_FAMILIES, delay_device)):
+            for family, maximum in families.items():
+                family_config = config.get(family) or {}
+                minimum = max(float(family_config.get("min", delay)), MIN_INTERVAL)
+                POLLING_BOUNDS[family] = {
+                    "min": minimum,
+                    "max": max(float(family_config.get("max", maximum or minimum)), minimum),
+                    "factor": float(family_config.get("factor", DEFAULT_FACTOR)),
+                }
+
+
+def polling_tick() -> int:
+    """Scheduler tick: the smallest min interval"""
+    if not POLLING_BOUNDS:
+        return 60
+    return int(min(bounds["min"] for bounds in POLLING_BOUNDS.values()))
+
+
+def _interval(site_id: str, family: str) -> AdaptiveInterval:
+    key = (site_id, family)
+    interval = INTERVALS.get(key)
+    if interval is None:
+        bounds = POLLING_BOUNDS.get(family) or {"min": 60, "max": 60, "factor": DEFAULT_FACTOR}
+        interval = INTERVALS[key] = AdaptiveInterval(bounds["min"], bounds["max"], bounds["factor"])
+    return interval
+
+
+def due_families(site_id: str, families: List[str]) -> List[str]:
+    """Families of a Site that must be polled now
+
+    Args:
+        site_id (str): Site ID
+        families (List[str]): Families to check
+
+    Returns:
+        List[str]: Due families
+    """
+    now = monotonic()
+    with POLLING_LOCK:
+        return [family for family in families if _interval(site_id, family).due(now)]
+
+
+def observe(site_id: str, family: str, payload: Any) -> bool:
+    """Record a polled payload
+
+    Args:
+        site_id (str): Site ID
+        family (str): Family
+        payload (Any): Polled payload (JSON serializable)
+
+    Returns:
+        bool: True if the payload changed
+    """
+    with POLLING_LOCK:
+        interval = _interval(site_id, family)
+        changed = interval.observe(payload, monotonic())
+        POLLED_AT[(site_id, family)] = time()
+        LOGGER.debug(f"{site_id} {family}: {'changed' if changed else 'stable'}, next poll in {interval.interval:.0f}s")
+    return changed
+
+
+def last_payload(site_id: str, family: str) -> Any:
+    """Last payload polled for a family of a Site"""
+    with POLLING_LOCK:
+        return _interval(site_id, family).payload
+
+
+def polled_at(site_id: str) -> Dict[str, float]:
+    """Last successful poll (epoch) of each family of a Site"""
+    with POLLING_LOCK:
+        return {family: polled for (site, family), polled in POLLED_AT.items() if site == site_id}
+
+
+def poll_now(site_id: str, family: str) -> None:
+    """Poll a family of a Site at the next tick, at its min interval"""
+    with POLLING_LOCK:
+        interval = _interval(site_id, family)
+        interval.interval = interval.minimum
+        interval.next_at = 0.0
+
+
+def export_payloads() -> Dict[str, Any]:
+    """Last payloads of every Site and family, JSON serializable
+
+    Returns:
+        Dict[str, Any]: Payloads by "site_id|family"
+    """
+    with POLLING_LOCK:
+        return {
+            f"{site_id}|{family}": loads(dumps(interval.payload, default=_serialize))
+            for (site_id, family), interval in INTERVALS.items()
+            if interval.payload is not None
+        }
+
+
+def load_payloads(payloads: Dict[str, Any], loaders: Optional[Dict[str, Any]] = None) -> None:
+    """Restore last payloads, families are next polled after their min interval
+
+    Args:
+        payloads (Dict[str, Any]): Payloads by "site_id|family"
+        loaders (Optional[Dict[str, Any]], optional): Callable rebuilding the payload of a family. Defaults to None.
+    """
+    loaders = loaders or {}
+    now = monotonic()
+    for key, payload in payloads.items():
+        site_id, family = key.split("|", 1)
+        if family in loaders:
+            payload = loaders[family](payload)
+        with POLLING_LOCK:
+            interval = _interval(site_id, family)
+            interval.observe(payload, now)
@@ -0,0 +1,259 @@
+"""Camera Snapshots"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+from requests import Response
+
+from business.polling import MIN_INTERVAL
+from myfox.api import MyFoxApi
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed for snapshot variants
+    Image = None
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_SNAPSHOT_SIZE = 256 * 1024
+
+DEFAULT_INTERVAL_ACTIVE = 60
+DEFAULT_INTERVAL_IDLE = 900
+DEFAULT_EVENT_WINDOW = 600
+ACTIVE_SECURITY_LEVELS = ("armed", "partial", "triggered")
+
+SNAPSHOT_CONFIG = {}
+VARIANT_EXECUTOR = None
+SNAPSHOT_LOCK = threading.Lock()
+# device_id => digest of the last published image
+SNAPSHOT_DIGESTS = {}
+# device_id => last snapshot time
+SNAPSHOT_TAKEN_AT = {}
+# site_id => security level
+SITE_SECURITY = {}
+# site_id => (time, event) of the last events
+SITE_EVENTS = {}
+
+
+def init_snapshot(config: Optional[Dict]) -> None:
+    """Init Snapshot settings
+
+    Args:
+        config (Optional[Dict]): Snapshot Configuration
+    """
+    global VARIANT_EXECUTOR  # pylint: disable=global-statement
+    SNAPSHOT_CONFIG.clear()
+    SNAPSHOT_CONFIG.update(config or {})
+
+    if SNAPSHOT_CONFIG.get("variants") and Image is None:
+        LOGGER.warning("Pillow is not installed, snapshot variants are disabled")
+    if snapshot_variants() and VARIANT_EXECUTOR is None:
+        VARIANT_EXECUTOR = ThreadPoolExecutor(
+            max_workers=int(SNAPSHOT_CONFIG.get("variant_workers", 2)),
+            thread_name_prefix="myfox-snapshot",
+        )
+
+
+def snapshot_variants() -> Dict[str, Dict]:
+    """Configured snapshot variants, empty if Pillow is missing
+
+    Returns:
+        Dict[str, Dict]: Variant settings by name
+    """
+    if Image is None:
+        return {}
+    return SNAPSHOT_CONFIG.get("variants") or {}
+
+
+def encode_variant(image: bytes, variant: Dict) -> bytes:
+    """Encode a reduced variant of a snapshot
+
+    Args:
+        image (bytes): Original JPEG
+        variant (Dict): Variant settings (max_size or scale, quality)
+
+    Returns:
+        bytes: Variant JPEG
+    """
+    with Image.open(BytesIO(image)) as original:
+        picture = original.convert("RGB")
+    if variant.get("max_size"):
+        picture.thumbnail((int(variant["max_size"]), int(variant["max_size"])))
+    elif variant.get("scale"):
+        scale = float(variant["scale"])
+        picture = picture.resize((max(int(picture.width * scale), 1), max(int(picture.height * scale), 1)))
+    output = BytesIO()
+    picture.save(output, format="JPEG", quality=int(variant.get("quality", 75)), optimize=True)
+    return output.getvalue()
+
+
+def submit_variants(image: bytearray, publish: Callable[[str, bytes], None]) -> List[Future]:
+    """Encode snapshot variants in the worker pool
+
+    Args:
+        image (bytearray): Original JPEG
+        publish (Callable[[str, bytes], None]): Called with variant name and JPEG once encoded
+
+    Returns:
+        List[Future]: Encoding futures
+    """
+    futures = []
+    if VARIANT_EXECUTOR is None:
+        return futures
+    original = bytes(image)
+    for name, variant in snapshot_variants().items():
+
+        def done(future: Future, name: str = name) -> None:
+            try:
+                publish(name, future.result())
+            except Exception as exp:  # pylint: disable=broad-except
+                LOGGER.warning(f"Unable to encode snapshot variant {name}: {exp}")
+
+        future = VARIANT_EXECUTOR.submit(encode_variant, original, variant or {})
+        future.add_done_callback(done)
+        futures.append(future)
+    return futures
+
+
+def snapshot_intervals() -> Dict[str, int]:
+    """Snapshot intervals in seconds (active, idle) and event window"""
+    return {
+        "active": max(int(SNAPSHOT_CONFIG.get("interval_active", DEFAULT_INTERVAL_ACTIVE)), MIN_INTERVAL),
+        "idle": max(int(SNAPSHOT_CONFIG.get("interval_idle", DEFAULT_INTERVAL_IDLE)), 60),
+        "event_window": int(SNAPSHOT_CONFIG.get("event_window", DEFAULT_EVENT_WINDOW)),
+    }
+
+
+def record_site_security(site_id: str, security_level: str) -> None:
+    """Remember the security level of a Site"""
+    SITE_SECURITY[site_id] = security_level
+
+
+def record_site_event(site_id: str, event: Dict) -> None:
+    """Remember a recent history event of a Site"""
+    with SNAPSHOT_LOCK:
+        SITE_EVENTS.setdefault(site_id, deque(maxlen=50)).append((monotonic(), event))
+
+
+def camera_active(site_id: str, device_id: str, device_label: str) -> bool:
+    """Check if a camera must be refreshed at the active rate
+
+    A camera is active while its site is armed, or when a recent history event mentions it.
+    """
+    if SITE_SECURITY.get(site_id) in ACTIVE_SECURITY_LEVELS:
+        return True
+    since = monotonic() - snapshot_intervals()["event_window"]
+    with SNAPSHOT_LOCK:
+        events = list(SITE_EVENTS.get(site_id, ()))
+    for created_at, event in events:
+        if created_at < since:
+            continue
+        if event.get("deviceId") == device_id or (device_label and device_label in str(event.get("label", ""))):
+            return True
+    return False
+
+
+def snapshot_due(site_id: str, device_id: str, device_label: str) -> bool:
+    """Check if a new snapshot of a camera is due
+
+    Args:
+        site_id (str): Site ID
+        device_id (str): Device ID
+        device_label (str): Device Label
+
+    Returns:
+        bool: True if the snapshot must be taken now
+    """
+    taken_at = SNAPSHOT_TAKEN_AT.get(device_id)
+    if taken_at is None:
+        return True
+    intervals = snapshot_intervals()
+    interval = intervals["active"] if camera_active(site_id, device_id, device_label) else intervals["idle"]
+    # Tolerate scheduler jitter
+    return monotonic() - taken_at >= interval - 5
+
+
+def snapshot_changed(device_id: str, image: bytearray) -> bool:
+    """Check if a snapshot differs from the last one published for this camera"""
+    digest = hashlib.blake2b(image, digest_size=16).digest()
+    with SNAPSHOT_LOCK:
+        SNAPSHOT_TAKEN_AT[device_id] = monotonic()
+        if SNAPSHOT_DIGESTS.get(device_id) == digest:
+            return False
+        SNAPSHOT_DIGESTS[device_id] = digest
+    return True
+
+
+def read_snapshot(response: Response) -> bytearray:
+    """Stream a snapshot response into one preallocated buffer
+
+    Args:
+        response (Response): Streamed snapshot response
+
+    Returns:
+        bytearray: Image
+    """
+    try:
+        length = int(response.headers.get("Content-Length") or 0)
+        buffer = bytearray(length or DEFAULT_SNAPSHOT_SIZE)
+        view = memoryview(buffer)
+        size = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            end = size + len(chunk)
+            if end > len(buffer):
+                # Buffer can't be resized while exported
+                view.release()
+                buffer.extend(bytes(max(end - len(buffer), len(buffer))))
+                view = memoryview(buffer)
+            view[size:end] = chunk
+            size = end
+        view.release()
+        del buffer[size:]
+        return buffer
+    finally:
+        response.close()
+
+
+def save_snapshot(device_id: str, image: bytearray) -> None:
+    """Write a snapshot to `snapshot.path`, if set
+
+    Args:
+        device_id (str): Device ID
+        image (bytearray): Image
+    """
+    path = SNAPSHOT_CONFIG.get("path")
+    if not path:
+        return
+    try:
+        with open(os.path.join(path, f"{device_id}.jpeg"), "wb") as snapshot_file:
+            snapshot_file.write(image)
+    except IOError as exp:
+        LOGGER.warning(f"Unable to save snapshot of {device_id}: {exp}")
+
+
+def fetch_snapshot(api: MyFoxApi, site_id: str, device_id: str) -> Optional[bytearray]:
+    """Take a Camera Snapshot, in memory
+
+    Args:
+        api (MyFoxApi): MyFoxApi
+        site_id (str): Site ID
+        device_id (str): Device ID
+
+    Returns:
+        Optional[bytearray]: Image, None if no snapshot was taken
+    """
+    response = api.camera_snapshot(site_id=site_id, device_id=device_id)
+    if response is None:
+        return None
+    if response.status_code != 200:
+        response.close()
+        return None
+    return read_snapshot(response)
@@ -0,0 +1,42 @@
+"""HomeAssistant Discovery Digests"""
+
+import hashlib
+import json
+import logging
+from typing import Dict
+
+from utils.codec import dumps
+
+LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_CACHE_PATH = "discovery.json"
+
+
+def discovery_digest(config: Dict) -> str:
+    """Digest of a discovery config
+
+    Args:
+        config (Dict): Discovery config
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256(dumps(config, sort_keys=True)).hexdigest()
+
+
+def read_discovery_digests(cache_path: str = DISCOVERY_CACHE_PATH) -> Dict[str, str]:
+    """Retrieve published discovery digests from a file"""
+    try:
+        with open(file=cache_path, mode="r", encoding="utf8") as cache:
+            return json.loads(cache.read())
+    except (IOError, ValueError):
+        return {}
+
+
+def write_discovery_digests(digests: Dict[str, str], cache_path: str = DISCOVERY_CACHE_PATH) -> None:
+    """Write published discovery digests into a file"""
+    try:
+        with open(file=cache_path, mode="w", encoding="utf8") as cache:
+            cache.write(json.dumps(digests))
+    except IOError as exp:
+        LOGGER.warning(f"Unable to write discovery digests to {cache_path}: {exp}")
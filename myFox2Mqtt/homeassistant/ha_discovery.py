@@ -717,6 +717,33 @@ def ha_discovery_history(site: Site, mqtt_config: dict):
     return site_config
 
 
+def ha_discovery_diagnostics(site: Site, mqtt_config: dict, sensor_name: str, sensor_config: dict):
+    """Auto Discover Bridge Diagnostics"""
+    diagnostic_config = {}
+
+    site_info = {
+        "identifiers": [site.siteId],
+        "manufacturer": "MyFox",
+        "model": "MyFox HC2",
+        "name": "MyFox HC2",
+        "sw_version": "MyFox2MQTT",
+    }
+
+    diagnostic_config["topic"] = (
+        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/sensor/{site.siteId}/{sensor_name}/config"
+    )
+    diagnostic_config["config"] = {
+        "name": f"{site.label}_{sensor_name}",
+        "unique_id": f"{site.siteId}_{site.label}_{sensor_name}",
+        "state_topic": f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site.siteId}/diagnostics",
+        "value_template": "{{ value_json." + sensor_name + " }}",
+        "entity_category": "diagnostic",
+        "device": site_info,
+    }
+    diagnostic_config["config"].update(sensor_config)
+    return diagnostic_config
+
+
 def ha_discovery_alarm_actions(site: Site, mqtt_config: dict):
     """Auto Discover Actions"""
     site_config = {}
@@ -837,8 +864,9 @@ def ha_discovery_cameras(
     site_id: str,
     device: Device,
     mqtt_config: dict,
+    variant: str = None,
 ):
-    """Auto Discover Cameras"""
+    """Auto Discover Cameras (or a snapshot variant)"""
     camera_config = {}
 
     device_info = {
@@ -849,13 +877,14 @@ def ha_discovery_cameras(
         "sw_version": "Unknown",
     }
 
+    name = f"snapshot_{variant}" if variant else "snapshot"
     camera_config["topic"] = (
-        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/camera/{site_id}_{device.device_id}/snapshot/config"
+        f"{mqtt_config.get('ha_discover_prefix', 'homeassistant')}/camera/{site_id}_{device.device_id}/{name}/config"
     )
     camera_config["config"] = {
-        "name": "snapshot",
-        "unique_id": f"{device.device_id}_snapshot",
-        "topic": f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/snapshot",
+        "name": name,
+        "unique_id": f"{device.device_id}_{name}",
+        "topic": f"{mqtt_config.get('topic_prefix', 'myFox2mqtt')}/{site_id}/{device.device_id}/{name}",
         "device": device_info,
     }
 
@@ -8,6 +8,8 @@ import time
 from exceptions import MyFoxInitError
 from myfox_2_mqtt import MyFox2Mqtt
 from utils import close_and_exit, setup_logger, read_config_file
+from utils.metrics import start_metrics_server
+from utils.payload_log import init_payload_logging
 from mqtt import init_mqtt
 from myfox.sso import init_sso
 from myfox.api import MyFoxApi
@@ -17,6 +19,7 @@ VERSION = "2024.9.2"
 
 def myfox_loop(config, mqtt_client, api):
     """MyFox 2 MQTT Loop"""
+    myfox_api = None
     try:
         myfox_api = MyFox2Mqtt(api=api, mqtt_client=mqtt_client, config=config)
         time.sleep(1)
@@ -24,6 +27,10 @@ def myfox_loop(config, mqtt_client, api):
     except MyFoxInitError as exc:
         LOGGER.error(f"Force stopping Api {exc}")
         close_and_exit(myfox_api, 3)
+    finally:
+        # The loop is restarted with a new MyFox2Mqtt, release this one
+        if myfox_api is not None:
+            myfox_api.close()
 
 
 if __name__ == "__main__":
@@ -37,15 +44,18 @@ if __name__ == "__main__":
     CONFIG_FILE = ARGS.configuration
     LOG_FILE = ARGS.logfile
 
+    CONFIG = read_config_file(CONFIG_FILE)
+
     # Setup Logger
-    setup_logger(debug=DEBUG, filename=LOG_FILE)
+    setup_logger(debug=DEBUG, filename=LOG_FILE, config=CONFIG.get("logging"))
     LOGGER = logging.getLogger(__name__)
     LOGGER.info(f"Starting MyFox2Mqtt {VERSION}")
-
-    CONFIG = read_config_file(CONFIG_FILE)
+    init_payload_logging(config=CONFIG.get("log_payloads"))
+    start_metrics_server(config=CONFIG.get("metrics"))
 
     SSO = init_sso(config=CONFIG)
-    API = MyFoxApi(sso=SSO)
+    API = MyFoxApi(sso=SSO, config=CONFIG.get("api"))
+
     MQTT_CLIENT = init_mqtt(config=CONFIG, api=API)
 
     try:
@@ -6,10 +6,12 @@ import ssl
 from time import sleep
 
 import paho.mqtt.client as mqtt
-from business.mqtt import consume_mqtt_message, SUBSCRIBE_TOPICS
+from business.mqtt import clear_publish_cache, consume_mqtt_message, republish_discovery, SUBSCRIBE_TOPICS
 from exceptions import MyFoxInitError
 from homeassistant.ha_discovery import ALARM_STATUS
 from myfox.api import MyFoxApi
+from mqtt.dispatcher import CommandDispatcher
+from utils.metrics import COMMAND_QUEUE_DEPTH
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,7 +20,25 @@ class MQTTClient:
     """MQTT Client Class"""
 
     def __init__(self, config, api, publish_delay=1):
+        """Init MQTTClient
+
+        Args:
+            config (dict): MQTT Configuration
+            api (MyFoxApi): MyFoxApi
+            publish_delay (int, optional): Publish delay. Defaults to 1.
+        """
         self.publish_delay = publish_delay
+        self.config = config
+        self.running = True
+        self.api = api
+        self.ha_status_topic = f"{config.get('ha_discover_prefix', 'homeassistant')}/status"
+        self.dispatcher = CommandDispatcher(
+            handler=self.consume,
+            workers=config.get("command_workers", 4),
+            queue_size=config.get("command_queue_size", 100),
+            prefix=config.get("topic_prefix", "myFox2mqtt"),
+        )
+        COMMAND_QUEUE_DEPTH.set_function(self.dispatcher.depth)
 
         self.client = mqtt.Client(client_id=config.get("client-id", "myfox"))
         self.client.on_connect = self.on_connect
@@ -32,17 +52,16 @@ class MQTTClient:
             self.client.tls_insecure_set(True)
         self.client.loop_start()
 
-        self.config = config
-        self.running = True
-        self.api = api
-
         LOGGER.debug("MQTT client initialized")
 
     def on_connect(self, mqttc, obj, flags, rc):  # pylint: disable=unused-argument,invalid-name
         """MQTT on_connect"""
         if rc == 0:
             LOGGER.info(f"Connected: {rc}")
-            for topic in SUBSCRIBE_TOPICS:
+            # Broker may have lost retained messages, publish everything again
+            clear_publish_cache()
+            republish_discovery(mqtt_client=self)
+            for topic in [self.ha_status_topic] + SUBSCRIBE_TOPICS:
                 LOGGER.info(f"Subscribing to: {topic}")
                 self.client.subscribe(topic)
         else:
@@ -51,6 +70,16 @@ class MQTTClient:
     def on_message(self, mqttc, obj, msg):  # pylint: disable=unused-argument
         """MQTT on_message"""
         LOGGER.debug(f"Message received on {msg.topic}: {msg.payload}")
+        if msg.topic == self.ha_status_topic:
+            if msg.payload == b"online":
+                # Home Assistant restarted, it may have lost the discovery configs
+                republish_discovery(mqtt_client=self)
+            return
+        # Never block the network thread with API calls
+        self.dispatcher.submit(msg)
+
+    def consume(self, msg):
+        """Process a queued MQTT message"""
         consume_mqtt_message(
             msg=msg,
             mqtt_config=self.config,
@@ -91,6 +120,7 @@ def init_mqtt(config: dict, api: MyFoxApi) -> MQTTClient:
 
     Args:
         config (dict): Global Configuration
+        api (MyFoxApi): MyFoxApi
 
     Raises:
         MyFoxInitError: Unable to init
@@ -0,0 +1,141 @@
+"""MQTT Command Dispatcher"""
+
+import logging
+import queue
+import threading
+import zlib
+from time import monotonic
+from typing import Any, Callable, Dict, List
+
+from utils.metrics import COMMAND_WAIT_SECONDS
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CommandDispatcher:
+    """Run MQTT commands in a pool of workers
+
+    Commands are queued on bounded queues, a given device (or site) always lands on the
+    same worker so its commands keep their order. Alarm commands have their own worker
+    so bursts of device commands never delay an arm / disarm.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], None],
+        workers: int = 4,
+        queue_size: int = 100,
+        prefix: str = "myFox2mqtt",
+    ):
+        """Init CommandDispatcher
+
+        Args:
+            handler (Callable[[Any], None]): Called with each MQTT message
+            workers (int, optional): Number of device workers. Defaults to 4.
+            queue_size (int, optional): Max queued commands per worker. Defaults to 100.
+            prefix (str, optional): Topic prefix of the commands, may contain "/". Defaults to "myFox2mqtt".
+        """
+        self.handler = handler
+        self.prefix = prefix.rstrip("/") + "/"
+        self.queue_size = max(int(queue_size), 1)
+        self.priority_queue = queue.Queue(maxsize=self.queue_size)
+        self.queues = [queue.Queue(maxsize=self.queue_size) for _ in range(max(int(workers), 1))]
+
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.last_wait = 0.0
+
+        self.threads = []  # type: List[threading.Thread]
+        for index, command_queue in enumerate([self.priority_queue] + self.queues):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(command_queue,),
+                name=f"myfox-command-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def _queue_for(self, topic: str) -> queue.Queue:
+        """Select the queue of a command topic"""
+        if topic.startswith(self.prefix):
+            topic = topic[len(self.prefix) :]
+        else:
+            # Unexpected topic, routed on its first level as if it was the prefix
+            topic = topic.split("/", 1)[-1]
+        parts = topic.split("/")
+        # {prefix}/{site_id}/command => Alarm
+        if len(parts) == 2:
+            return self.priority_queue
+        key = "/".join(parts[0:2])
+        return self.queues[zlib.crc32(key.encode("utf8")) % len(self.queues)]
+
+    def submit(self, msg: Any) -> bool:
+        """Queue a MQTT message
+
+        Args:
+            msg (Any): MQTT message
+
+        Returns:
+            bool: False if the queue is full and the command is dropped
+        """
+        command_queue = self._queue_for(msg.topic)
+        try:
+            command_queue.put_nowait((monotonic(), msg))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            LOGGER.warning(f"Command queue full, dropping message on {msg.topic}")
+            return False
+        depth = command_queue.qsize()
+        with self.lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, depth)
+        if depth > self.queue_size * 0.8:
+            LOGGER.warning(f"Command queue almost full: {depth}/{self.queue_size}")
+        return True
+
+    def _worker(self, command_queue: queue.Queue) -> None:
+        """Consume a queue forever"""
+        while True:
+            enqueued_at, msg = command_queue.get()
+            wait = monotonic() - enqueued_at
+            COMMAND_WAIT_SECONDS.observe(wait)
+            LOGGER.debug(f"Command on {msg.topic} waited {wait:.3f}s")
+            try:
+                self.handler(msg)
+                with self.lock:
+                    self.processed += 1
+                    self.last_wait = wait
+            except Exception as exp:  # pylint: disable=broad-except
+                with self.lock:
+                    self.failed += 1
+                LOGGER.error(f"Error when processing command on {msg.topic}: {exp}")
+            finally:
+                command_queue.task_done()
+
+    def depth(self) -> int:
+        """Commands waiting to be processed"""
+        return self.priority_queue.qsize() + sum(command_queue.qsize() for command_queue in self.queues)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue metrics
+
+        Returns:
+            Dict[str, Any]: Queue depth and counters
+        """
+        with self.lock:
+            return {
+                "depth": self.depth(),
+                "priority_depth": self.priority_queue.qsize(),
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "last_wait": self.last_wait,
+            }
@@ -1,15 +1,22 @@
 """MyFox Api"""
 
 import logging
-import json
-from json import JSONDecodeError
-from typing import Any, Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import monotonic
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 from myfox.api.devices.category import Category
 from myfox.api.model import AvailableStatus, Device, Site, User
+from myfox.api.ratelimit import Priority
+from myfox.api.transport import MyFoxTransport, endpoint_family
 from myfox.sso import MyFoxSso
 from oauthlib.oauth2 import TokenExpiredError
 from requests import Response
+from utils.codec import JSONDecodeError, loads
+from utils.metrics import API_ERRORS, API_REQUEST_SECONDS, path_template
+from utils.payload_log import log_payload
 
 LOGGER = logging.getLogger(__name__)
 
@@ -53,12 +60,48 @@ ACTION_LIST = [
     "sound_test",
 ]
 
+# Per site device endpoints, by name
+DEVICE_ENDPOINTS = {
+    "devices": "get_devices",
+    "temperature": "get_devices_temperature",
+    "light": "get_devices_light",
+    "state": "get_devices_state",
+    "other": "get_devices_other",
+    "camera": "get_devices_camera",
+    "shutter": "get_devices_shutter",
+    "gate": "get_devices_gate",
+    "socket": "get_devices_socket",
+}
+
 
 class MyFoxApi:
     """MyFox Api Class"""
 
-    def __init__(self, sso: MyFoxSso):
+    def __init__(self, sso: MyFoxSso, config: Optional[Dict[str, Any]] = None):
+        """Init MyFoxApi
+
+        Args:
+            sso (MyFoxSso): MyFoxSso
+            config (Optional[Dict[str, Any]], optional): Api Configuration. Defaults to None.
+        """
         self.sso = sso
+        self.transport = MyFoxTransport(
+            session=self.sso._oauth,  # pylint: disable=protected-access
+            config=config,
+        )
+        self._token_lock = threading.Lock()
+        self._context = threading.local()
+        self.executor = ThreadPoolExecutor(
+            max_workers=int((config or {}).get("max_workers", self.transport.pool_maxsize)),
+            thread_name_prefix="myfox-api",
+        )
+
+        # Site Registry
+        self.sites_ttl = int((config or {}).get("sites_ttl", 3600))
+        self._sites = {}  # type: Dict[str, Site]
+        self._sites_expire_at = 0.0
+        self._sites_lock = threading.Lock()
+        self._sites_timer = None
 
     def _request(self, method: str, path: str, **kwargs: Any) -> Response:
         """Make a request.
@@ -75,23 +118,86 @@ class MyFoxApi:
         """
 
         url = f"{BASE_URL}{path}"
+        family = endpoint_family(method, path)
+        priority = self.current_priority()
+        template = path_template(path)
+        start = monotonic()
+        expired_token = self.sso._oauth.token  # pylint: disable=protected-access
         try:
-            return getattr(self.sso._oauth, method)(url, **kwargs)  # pylint: disable=protected-access
-        except TokenExpiredError:
-            self.sso._oauth.token = self.sso.refresh_tokens()  # pylint: disable=protected-access
+            try:
+                response = self.transport.send(method, url, family, priority=priority, **kwargs)
+            except TokenExpiredError:
+                self._refresh_token(expired_token)
+
+                response = self.transport.send(method, url, family, priority=priority, **kwargs)
+        except Exception as exp:
+            API_ERRORS.inc(method=method, path=template, reason=type(exp).__name__)
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(monotonic() - start, method=method, path=template)
+        if response.status_code >= 400:
+            API_ERRORS.inc(method=method, path=template, reason=str(response.status_code))
+        return response
+
+    @staticmethod
+    def _json(response: Response) -> Any:
+        """Parse a response body, once, with the shared JSON codec
+
+        Args:
+            response (Response): requests Response object
+
+        Raises:
+            JSONDecodeError: Invalid JSON
+
+        Returns:
+            Any: Parsed body
+        """
+        return loads(response.content)
 
-            return getattr(self.sso._oauth, method)(url, **kwargs)  # pylint: disable=protected-access
+    def current_priority(self) -> Optional[Priority]:
+        """Priority forced for the requests of the current thread, None to use the endpoint default"""
+        return getattr(self._context, "priority", None)
 
-    def get(self, path: str) -> Response:
+    @contextmanager
+    def priority(self, priority: Optional[Priority]) -> Iterator[None]:
+        """Force the priority of the requests made by the current thread
+
+        Args:
+            priority (Optional[Priority]): Request priority
+        """
+        previous = self.current_priority()
+        self._context.priority = priority
+        try:
+            yield
+        finally:
+            self._context.priority = previous
+
+    def _with_priority(self, priority: Optional[Priority], func: Callable, **kwargs: Any) -> Any:
+        """Call func with a forced priority (used from executor threads)"""
+        with self.priority(priority):
+            return func(**kwargs)
+
+    def _refresh_token(self, expired_token: Dict) -> None:
+        """Refresh the token once, even when several concurrent requests hit the expiration.
+
+        Args:
+            expired_token (Dict): Token used by the failing request
+        """
+        with self._token_lock:
+            if self.sso._oauth.token is expired_token:  # pylint: disable=protected-access
+                self.sso._oauth.token = self.sso.refresh_tokens()  # pylint: disable=protected-access
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Response:
         """Fetch an URL from the MyFox API.
 
         Args:
             path (str): Path to request
+            params (Optional[Dict[str, Any]], optional): Query parameters. Defaults to None.
 
         Returns:
             Response: requests Response object
         """
-        return self._request("get", path)
+        return self._request("get", path, params=params)
 
     def post(self, path: str, *, json: Dict[str, Any]) -> Response:
         """Post data to the MyFox API.
@@ -115,7 +221,7 @@ class MyFoxApi:
         Returns:
             Response: requests Response object
         """
-        LOGGER.info(json)
+        log_payload(LOGGER, f"PUT {path}", json)
         return self._request("put", path, json=json)
 
     def get_sites(self) -> List[Site]:
@@ -126,8 +232,75 @@ class MyFoxApi:
         """
         response = self.get("/v2/client/site/items")
         response.raise_for_status()
-        LOGGER.info(f"Sites: {response.json()}")
-        return [Site(**s) for s in response.json().get("payload").get("items")]
+        content = self._json(response)
+        log_payload(LOGGER, "Sites", content)
+        return [Site(**s) for s in content.get("payload").get("items")]
+
+    def get_site_registry(self, force: bool = False) -> Dict[str, Site]:
+        """Get All Sites, indexed by Site ID, from a TTL cache
+
+        Args:
+            force (bool, optional): Bypass the cache. Defaults to False.
+
+        Returns:
+            Dict[str, Site]: Site objects by Site ID
+        """
+        with self._sites_lock:
+            if force or not self._sites or monotonic() >= self._sites_expire_at:
+                self._sites = {site.siteId: site for site in self.get_sites()}
+                self._sites_expire_at = monotonic() + self.sites_ttl
+            return self._sites
+
+    def load_site_registry(self, sites: List[Site]) -> None:
+        """Fill the Site registry with known Sites (warm restart)
+
+        Args:
+            sites (List[Site]): Site objects
+        """
+        with self._sites_lock:
+            self._sites = {site.siteId: site for site in sites}
+            self._sites_expire_at = monotonic() + self.sites_ttl
+
+    def get_cached_sites(self) -> Dict[str, Site]:
+        """Get the Sites of the registry, without fetching them
+
+        Returns:
+            Dict[str, Site]: Site objects by Site ID, empty if never fetched
+        """
+        with self._sites_lock:
+            return dict(self._sites)
+
+    def get_cached_site(self, site_id: str) -> Optional[Site]:
+        """Get a Site from the registry
+
+        Args:
+            site_id (str): Site ID
+
+        Returns:
+            Optional[Site]: Site object, None if unknown
+        """
+        return self.get_site_registry().get(site_id)
+
+    def invalidate_sites(self) -> None:
+        """Invalidate the Site registry, next access will fetch Sites again"""
+        with self._sites_lock:
+            self._sites_expire_at = 0.0
+
+    def start_sites_refresh(self) -> None:
+        """Refresh the Site registry in background every `sites_ttl` seconds"""
+        if self._sites_timer is not None:
+            self._sites_timer.cancel()
+        self._sites_timer = threading.Timer(self.sites_ttl, self._refresh_sites)
+        self._sites_timer.daemon = True
+        self._sites_timer.start()
+
+    def _refresh_sites(self) -> None:
+        """Background Site registry refresh"""
+        try:
+            self.get_site_registry(force=True)
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.warning(f"Error while refreshing sites: {exp}")
+        self.start_sites_refresh()
 
     def get_site(self, site_id: str) -> Dict:
         """Get Site
@@ -141,8 +314,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}")
         response.raise_for_status()
-        LOGGER.info(f"Site: {response.json()}")
-        return response.json()
+        content = self._json(response)
+        log_payload(LOGGER, "Site", content)
+        return content
 
     def get_site_status(self, site_id: str) -> Dict:
         """Get Site
@@ -156,8 +330,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/security")
         response.raise_for_status()
-        LOGGER.info(f"Site Status: {response.json()}")
-        return response.json()
+        content = self._json(response)
+        log_payload(LOGGER, "Site Status", content)
+        return content
 
     def update_security_level(self, site_id: str, security_level: AvailableStatus) -> Dict:
         """Set Alarm Security Level
@@ -170,7 +345,7 @@ class MyFoxApi:
         """
         response = self.post(f"/v2/site/{site_id}/security/set/{security_level.lower()}", json={})
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def stop_alarm(self, site_id: str) -> Dict:
         """Stop Current Alarm
@@ -182,7 +357,7 @@ class MyFoxApi:
         """
         response = self.put(f"/v2/site/{site_id}/alarm/stop", json={})
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def trigger_alarm(self, site_id: str, mode: str) -> Dict:
         """Trigger Alarm
@@ -198,7 +373,7 @@ class MyFoxApi:
         payload = {"type": mode}
         response = self.post(f"/v2/site/{site_id}/panic", json=payload)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def action_device(
         self,
@@ -224,7 +399,7 @@ class MyFoxApi:
             json={"action": action},
         )
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def update_device(
         self,
@@ -253,7 +428,7 @@ class MyFoxApi:
         payload = {"settings": settings, "label": device_label}
         response = self.put(f"/v2/site/{site_id}/device/{device_id}", json=payload)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def camera_snapshot(self, site_id: str, device_id: str):
         """Get Camera Snapshot
@@ -263,15 +438,24 @@ class MyFoxApi:
             device_id (str): Site ID
 
         Returns:
-            Response: Response Image
+            Response: Response Image (streamed, body not read yet, to be closed by the caller), None if no image
         """
-        response = self.post(
+        response = self._request(
+            "post",
             f"/v2/site/{site_id}/device/{device_id}/camera/preview/take",
             json={},
+            stream=True,
         )
-        response.raise_for_status()
+        # Streamed connections go back to the pool only once closed
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
         if response.status_code == 200:
             return response
+        response.close()
+        return None
 
     def get_devices(self, site_id: str, category: Optional[Category] = None) -> List[Device]:
         """List Devices from a Site ID
@@ -286,15 +470,15 @@ class MyFoxApi:
         devices = []  # type: List[Device]
         response = self.get(f"/v2/site/{site_id}/device")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices: {response.json()}")
+        log_payload(LOGGER, "Devices", content)
         devices += [
-            Device(**d)
-            for d in content.get("payload").get("items")
+            device
+            for device in (Device(**d) for d in content.get("payload").get("items"))
             if category is None
-            or category.value.lower() in Device(**d).device_definition.get("device_definition_label").lower()
+            or category.value.lower() in device.device_definition.get("device_definition_label").lower()
         ]
         return devices
 
@@ -310,8 +494,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/{device_id}")
         response.raise_for_status()
-        LOGGER.info(f"Device: {response.json()}")
-        return Device(**response.json())
+        content = self._json(response)
+        log_payload(LOGGER, "Device", content)
+        return Device(**content)
 
     def get_users(self, site_id: str) -> List[User]:
         """List Users from a Site ID
@@ -324,7 +509,7 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/user")
         response.raise_for_status()
-        return [User(**s) for s in response.json().get("items")]
+        return [User(**s) for s in self._json(response).get("items")]
 
     def get_user(self, site_id: str, user_id: str) -> User:
         """Get User details
@@ -338,7 +523,7 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/user/{user_id}")
         response.raise_for_status()
-        return User(**response.json())
+        return User(**self._json(response))
 
     def action_user(
         self,
@@ -364,7 +549,7 @@ class MyFoxApi:
             json={"action": action},
         )
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def get_scenarios_core(
         self,
@@ -380,7 +565,7 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/scenario-core")
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def get_scenarios(
         self,
@@ -396,10 +581,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/scenario/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Scenarios: {response.json()}")
+        log_payload(LOGGER, "Scenarios", content)
         return content.get("payload").get("items")
 
     def scenario_action(
@@ -426,9 +611,10 @@ class MyFoxApi:
             json={},
         )
 
-        LOGGER.info(f"Scenario Action: {response.status_code} => {response.text}")
+        LOGGER.info(f"Scenario Action: {response.status_code}")
+        log_payload(LOGGER, "Scenario Action", response.content)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def get_devices_temperature(self, site_id: str):
         """List Devices from a Site ID
@@ -441,10 +627,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/data/temperature/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Temperature: {response.json()}")
+        log_payload(LOGGER, "Devices Temperature", content)
         return content.get("payload").get("items")
 
     def get_device_temperature(self, site_id: str, device_id: str):
@@ -459,8 +645,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/{device_id}/data/temperature/")
         response.raise_for_status()
-        LOGGER.info(f"Device: {response.json()}")
-        return response.json()
+        content = self._json(response)
+        log_payload(LOGGER, "Device", content)
+        return content
 
     def get_devices_state(self, site_id: str):
         """List Devices from a Site ID
@@ -474,10 +661,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/data/state/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices State: {response.json()}")
+        log_payload(LOGGER, "Devices State", content)
         return content.get("payload").get("items")
 
     def get_device_state(self, site_id: str, device_id: str):
@@ -492,8 +679,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/{device_id}/data/state/")
         response.raise_for_status()
-        LOGGER.info(f"Device: {response.json()}")
-        return response.json()
+        content = self._json(response)
+        log_payload(LOGGER, "Device", content)
+        return content
 
     def get_devices_light(self, site_id: str):
         """List Devices from a Site ID
@@ -507,10 +695,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/data/light/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Light: {response.json()}")
+        log_payload(LOGGER, "Devices Light", content)
         return content.get("payload").get("items")
 
     def get_device_light(self, site_id: str, device_id: str):
@@ -525,8 +713,9 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/{device_id}/data/light/")
         response.raise_for_status()
-        LOGGER.info(f"Light: {response.json()}")
-        return response.json()
+        content = self._json(response)
+        log_payload(LOGGER, "Light", content)
+        return content
 
     def get_devices_other(
         self,
@@ -543,10 +732,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/data/other/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Other: {response.json()}")
+        log_payload(LOGGER, "Devices Other", content)
         return content.get("payload").get("items")
 
     def get_devices_camera(
@@ -564,27 +753,28 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/camera/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Camera: {response.json()}")
+        log_payload(LOGGER, "Devices Camera", content)
         return content.get("payload").get("items")
 
-    def get_site_history(self, site_id: str):
-        """Get Site History from a Site ID
+    def get_site_history(self, site_id: str, offset: int = 0):
+        """Get Site History from a Site ID, newest events first
 
         Args:
             site_id (Optional[str], optional): Site ID. Defaults to None.
+            offset (int, optional): Number of events to skip (pagination). Defaults to 0.
 
         Returns:
             List[Event]: List of Event
         """
-        response = self.get(f"/v2/site/{site_id}/history")
+        response = self.get(f"/v2/site/{site_id}/history", params={"offset": offset} if offset else None)
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Site History: {response.json()}")
+        log_payload(LOGGER, "Site History", content)
         return content.get("payload").get("items")
 
     def get_devices_shutter(self, site_id: str):
@@ -598,10 +788,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/shutter/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Shutter: {response.json()}")
+        log_payload(LOGGER, "Devices Shutter", content)
         return content.get("payload").get("items")
 
     def shutter_action_device(
@@ -627,9 +817,10 @@ class MyFoxApi:
             f"/v2/site/{site_id}/device/{device_id}/shutter/{action}",
             json={},
         )
-        LOGGER.info(f"Shutter Action: {response.status_code} => {response.text}")
+        LOGGER.info(f"Shutter Action: {response.status_code}")
+        log_payload(LOGGER, "Shutter Action", response.content)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def get_devices_gate(self, site_id: str):
         """Get Devices Gate from a Site ID
@@ -642,10 +833,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/gate/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Gate: {response.json()}")
+        log_payload(LOGGER, "Devices Gate", content)
         return content.get("payload").get("items")
 
     def gate_action_device(
@@ -671,9 +862,10 @@ class MyFoxApi:
             f"/v2/site/{site_id}/device/{device_id}/gate/perform/{action}",
             json={},
         )
-        LOGGER.info(f"Gate Action: {response.status_code} => {response.text}")
+        LOGGER.info(f"Gate Action: {response.status_code}")
+        log_payload(LOGGER, "Gate Action", response.content)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
     def get_devices_socket(self, site_id: str):
         """Get Devices Socket from a Site ID
@@ -686,10 +878,10 @@ class MyFoxApi:
         """
         response = self.get(f"/v2/site/{site_id}/device/socket/items")
         try:
-            content = response.json()
+            content = self._json(response)
         except JSONDecodeError:
             response.raise_for_status()
-        LOGGER.info(f"Devices Socket: {response.json()}")
+        log_payload(LOGGER, "Devices Socket", content)
         return content.get("payload").get("items")
 
     def socket_action_device(
@@ -715,6 +907,31 @@ class MyFoxApi:
             f"/v2/site/{site_id}/device/{device_id}/socket/{action}",
             json={},
         )
-        LOGGER.info(f"Socket Action: {response.status_code} => {response.text}")
+        LOGGER.info(f"Socket Action: {response.status_code}")
+        log_payload(LOGGER, "Socket Action", response.content)
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
+
+    def get_site_devices_data(self, site_id: str, endpoints: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Fetch several device endpoints of a Site concurrently
+
+        Args:
+            site_id (str): Site ID
+            endpoints (Optional[List[str]], optional): Endpoints names (see DEVICE_ENDPOINTS). Defaults to all.
+
+        Returns:
+            Dict[str, Any]: Result of each endpoint, by name
+        """
+        if endpoints is None:
+            endpoints = list(DEVICE_ENDPOINTS)
+        priority = self.current_priority()
+        futures = {
+            endpoint: self.executor.submit(
+                self._with_priority,
+                priority,
+                getattr(self, DEVICE_ENDPOINTS[endpoint]),
+                site_id=site_id,
+            )
+            for endpoint in endpoints
+        }
+        return {endpoint: future.result() for endpoint, future in futures.items()}
@@ -0,0 +1,139 @@
+"""MyFox Api Rate Limit"""
+
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Dict, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Request priority, lower is more important"""
+
+    COMMAND = 0
+    SITE = 1
+    DEVICE = 2
+    BACKGROUND = 3
+
+
+# Default priority of each endpoint family
+FAMILY_PRIORITY = {
+    "command": Priority.COMMAND,
+    "site": Priority.SITE,
+    "history": Priority.SITE,
+    "devices": Priority.DEVICE,
+    "device_data": Priority.DEVICE,
+    "snapshot": Priority.BACKGROUND,
+}
+
+# Part of the bucket kept for more important requests
+DEFAULT_RESERVES = {
+    Priority.COMMAND: 0.0,
+    Priority.SITE: 0.1,
+    Priority.DEVICE: 0.25,
+    Priority.BACKGROUND: 0.5,
+}
+
+
+def parse_retry_after(value: Optional[str], default: float = 60) -> float:
+    """Parse a Retry-After header
+
+    Args:
+        value (Optional[str]): Header value (seconds or HTTP date)
+        default (float, optional): Delay if missing or invalid. Defaults to 60.
+
+    Returns:
+        float: Delay in seconds
+    """
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    """Token bucket shared by every API request
+
+    Each priority may only take a token while the bucket holds more than its reserve,
+    so polling yields to commands and site status when the budget runs low.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """Init RateLimiter
+
+        Args:
+            config (Optional[Dict[str, Any]], optional): Rate limit Configuration. Defaults to None.
+        """
+        config = config or {}
+        self.rate = float(config.get("requests_per_minute", 0)) / 60
+        self.capacity = float(config.get("burst", 40))
+        self.tokens = self.capacity
+        self.reserves = dict(DEFAULT_RESERVES)
+        for name, reserve in (config.get("reserves") or {}).items():
+            self.reserves[Priority[name.upper()]] = float(reserve)
+        self.paused_until = 0.0
+        self.updated_at = monotonic()
+        self.condition = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        """Token bucket is disabled with requests_per_minute: 0 (default), 429 pauses still apply"""
+        return self.rate > 0
+
+    def _refill(self, now: float) -> None:
+        # No token is earned while paused
+        elapsed = max(now - max(self.updated_at, self.paused_until), 0.0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self, priority: Priority) -> float:
+        """Wait for a token
+
+        Args:
+            priority (Priority): Request priority
+
+        Returns:
+            float: Time waited in seconds
+        """
+        start = monotonic()
+        if not self.enabled and start >= self.paused_until:
+            return 0.0
+        reserve = self.reserves.get(priority, 0.0) * self.capacity
+        with self.condition:
+            while True:
+                now = monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                    continue
+                if not self.enabled:
+                    return now - start
+                self._refill(now)
+                if self.tokens - 1 >= reserve:
+                    self.tokens -= 1
+                    waited = now - start
+                    if waited > 1:
+                        LOGGER.info(f"Request ({priority.name}) throttled for {waited:.2f}s")
+                    return waited
+                self.condition.wait((reserve + 1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop every request for a while (HTTP 429)
+
+        Args:
+            seconds (float): Pause duration
+        """
+        LOGGER.warning(f"API rate limited, pausing requests for {seconds:.0f}s")
+        with self.condition:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+            self.tokens = 0
+            self.condition.notify_all()
@@ -0,0 +1,160 @@
+"""MyFox Api Transport"""
+
+import logging
+import random
+import re
+from time import sleep
+from typing import Any, Dict, Optional, Tuple
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import ConnectTimeout, Timeout
+
+from myfox.api.ratelimit import FAMILY_PRIORITY, Priority, RateLimiter, parse_retry_after
+
+LOGGER = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds, per endpoint family
+DEFAULT_TIMEOUTS = {
+    "site": (3.05, 10),
+    "history": (3.05, 15),
+    "devices": (3.05, 15),
+    "device_data": (3.05, 15),
+    "command": (3.05, 20),
+    "snapshot": (3.05, 30),
+}
+
+RETRY_STATUS = (502, 503, 504)
+
+SNAPSHOT_PATH = re.compile(r"/camera/preview/take$")
+HISTORY_PATH = re.compile(r"/history$")
+DEVICE_DATA_PATH = re.compile(r"/device/(data/\w+|camera|shutter|gate|socket)/items$")
+DEVICES_PATH = re.compile(r"/device(/[^/]+)?/?$")
+
+
+def endpoint_family(method: str, path: str) -> str:
+    """Classify a request into an endpoint family
+
+    Args:
+        method (str): HTTP Method
+        path (str): Path to request
+
+    Returns:
+        str: Endpoint family
+    """
+    if SNAPSHOT_PATH.search(path):
+        return "snapshot"
+    if method.lower() != "get":
+        return "command"
+    if HISTORY_PATH.search(path):
+        return "history"
+    if DEVICE_DATA_PATH.search(path):
+        return "device_data"
+    if DEVICES_PATH.search(path):
+        return "devices"
+    return "site"
+
+
+class MyFoxTransport:
+    """Pooled keep-alive transport with per family timeouts and bounded retries"""
+
+    def __init__(self, session: Session, config: Optional[Dict[str, Any]] = None):
+        """Init MyFoxTransport
+
+        Args:
+            session (Session): Session used to send requests (OAuth2Session)
+            config (Optional[Dict[str, Any]], optional): Api Configuration. Defaults to None.
+        """
+        config = config or {}
+        self.session = session
+        self.retries = max(int(config.get("retries", 2)), 0)
+        self.backoff = float(config.get("backoff", 0.5))
+        self.backoff_max = float(config.get("backoff_max", 10))
+
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        for family, timeout in (config.get("timeouts") or {}).items():
+            if isinstance(timeout, (int, float)):
+                timeout = (DEFAULT_TIMEOUTS.get(family, DEFAULT_TIMEOUTS["site"])[0], timeout)
+            self.timeouts[family] = tuple(timeout)
+
+        self.pool_maxsize = int(config.get("pool_maxsize", 10))
+        adapter = HTTPAdapter(
+            pool_connections=int(config.get("pool_connections", 4)),
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.limiter = RateLimiter(config=config.get("rate_limit"))
+
+    def timeout(self, family: str) -> Tuple[float, float]:
+        """Get (connect, read) timeout for an endpoint family
+
+        Args:
+            family (str): Endpoint family
+
+        Returns:
+            Tuple[float, float]: Connect and read timeouts
+        """
+        return self.timeouts.get(family, DEFAULT_TIMEOUTS["site"])
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter backoff delay for an attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2**attempt)))
+
+    def send(
+        self,
+        method: str,
+        url: str,
+        family: str,
+        priority: Optional[Priority] = None,
+        **kwargs: Any,
+    ) -> Response:
+        """Send a request, retrying transient failures.
+
+        Only idempotent (GET) requests are retried on read timeouts and gateway errors,
+        other methods are only retried when the connection could not be established
+        or when the API answered 429 (Too Many Requests).
+
+        Args:
+            method (str): HTTP Method
+            url (str): URL to request
+            family (str): Endpoint family
+            priority (Optional[Priority], optional): Request priority. Defaults to the family priority.
+
+        Returns:
+            Response: requests Response object
+        """
+        kwargs.setdefault("timeout", self.timeout(family))
+        if priority is None:
+            priority = FAMILY_PRIORITY.get(family, Priority.DEVICE)
+        idempotent = method.lower() == "get"
+        attempt = 0
+        while True:
+            self.limiter.acquire(priority)
+            try:
+                response = getattr(self.session, method)(url, **kwargs)
+            except ConnectTimeout as exp:
+                if attempt >= self.retries:
+                    raise
+                LOGGER.warning(f"Connect timeout on {url} ({exp}), retrying")
+            except (Timeout, RequestsConnectionError) as exp:
+                if not idempotent or attempt >= self.retries:
+                    raise
+                LOGGER.warning(f"Request failed on {url} ({exp}), retrying")
+            else:
+                if response.status_code == 429:
+                    self.limiter.pause(parse_retry_after(response.headers.get("Retry-After")))
+                    if attempt >= self.retries:
+                        return response
+                    response.close()
+                    attempt += 1
+                    continue
+                if not idempotent or response.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    return response
+                LOGGER.warning(f"Got {response.status_code} on {url}, retrying")
+                response.close()
+            sleep(self._backoff(attempt))
+            attempt += 1
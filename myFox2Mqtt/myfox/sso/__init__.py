@@ -11,6 +11,8 @@ from exceptions import MyFoxInitError
 from oauthlib.oauth2 import LegacyApplicationClient, TokenExpiredError
 from requests import Response
 from requests_oauthlib import OAuth2Session
+from utils.metrics import TOKEN_REFRESHES
+from utils.payload_log import log_payload
 
 LOGGER = logging.getLogger(__name__)
 
@@ -91,11 +93,12 @@ class MyFoxSso:
         """
         LOGGER.info("Refreshing Token")
         token = self._oauth.refresh_token(MYFOX_TOKEN)
+        TOKEN_REFRESHES.inc()
 
         if self.token_updater is not None:
             self.token_updater(token)
 
-        LOGGER.info(f"New Token: {token}")
+        log_payload(LOGGER, "New Token", token)
         return token
 
 
@@ -1,19 +1,38 @@
 """MyFox 2 Mqtt"""
 
 import logging
+import threading
 from time import sleep
+from typing import Any, Callable, Dict, List, Tuple
 
 from exceptions import MyFoxInitError
 import schedule
 from myfox.api import MyFoxApi
+from myfox.api.model import Device, Site
+from myfox.api.ratelimit import Priority
 from business import (
+    publish_restored_state,
     update_camera_snapshot,
     update_devices_status,
     update_sites_status,
     ha_devices_config,
     ha_sites_config,
 )
+from business.diagnostics import diagnostics_enabled, diagnostics_interval, init_diagnostics, publish_diagnostics
+from business.history import (
+    export_history_cursors,
+    export_history_dedup,
+    init_history,
+    load_history_cursors,
+    load_history_dedup,
+)
+from business.pipeline import init_site_pool
+from business.polling import export_payloads, init_polling, load_payloads, polling_tick
+from business.snapshot import init_snapshot, snapshot_intervals
+from homeassistant.discovery_cache import DISCOVERY_CACHE_PATH
 from mqtt import MQTTClient
+from utils.payload_log import is_secret
+from utils.state_store import STATE_STORE_PATH, open_state_store
 
 LOGGER = logging.getLogger(__name__)
 
@@ -49,88 +68,190 @@ class MyFox2Mqtt:
 
         self.manual_snapshot = config.get("manual_snapshot", False)
 
+        init_site_pool(max_workers=config.get("max_site_workers", 4))
+        init_snapshot(config=config.get("snapshot"))
+        init_history(config=config.get("history"))
+        init_diagnostics(config=config.get("diagnostics"))
+        init_polling(config=config.get("polling"), delay_site=self.delay_site, delay_device=self.delay_device)
+
         self.api = api
         self.mqtt_client = mqtt_client
 
         self.homeassistant_config = config.get("homeassistant_config")
+        self.discovery_cache = config.get("discovery_cache", DISCOVERY_CACHE_PATH)
 
         self.mqtt_config = config.get("mqtt")
         if self.mqtt_config is None:
             raise MyFoxInitError
 
-        sites = self.api.get_sites()
+        self.store = open_state_store(config.get("state_store", STATE_STORE_PATH))
+        self.state_store_interval = max(int(config.get("state_store_interval", 60)), 10)
+        self.warm = self.restore_state()
+
+        # Warm restart: the registry is reconciled with the API in the background, see loop()
+        try:
+            self.select_sites(list(self.api.get_site_registry(force=not self.warm).values()))
+        except Exception:
+            self.close()
+            raise
+
+    def select_sites(self, sites: List[Site]) -> None:
+        """Keep the Sites set in configuration
+
+        my_sites_id is updated in place, scheduled jobs share it.
+
+        Args:
+            sites (List[Site]): Site objects
+        """
         LOGGER.info(f"Found {len(sites)} Site(s)")
+        my_sites_id = []
         for site in sites:
             LOGGER.info(f"Found Site : {site.label}")
             if site.label in self.my_sites:
                 LOGGER.info(f"Storing Site ID for {site.label}")
-                self.my_sites_id.append(site.siteId)
+                my_sites_id.append(site.siteId)
             else:
                 LOGGER.info(f"Site '{site.label}' is not set in configuration, Update it if you want to add this Site")
+        self.my_sites_id[:] = my_sites_id
 
-    def close(self) -> None:  # pylint: disable=no-self-use
-        """Close"""
+    def close(self) -> None:
+        """Close, the state store is released so a new instance can be started"""
+        if self.store is not None:
+            self.save_state()
+            self.store.close()
+            self.store = None
 
-    def loop(self) -> None:
-        """Main Loop"""
-        # Config
-        ha_sites_config(
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-            homeassistant_config=self.homeassistant_config,
-        )
-        ha_devices_config(
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-        )
+    def restore_state(self) -> bool:
+        """Restore the last known state (published events, history cursors, Sites, polled payloads)
 
-        # Device Update (First Run Only)
-        update_sites_status(
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-        )
-        if not self.manual_snapshot:
-            update_camera_snapshot(
+        Published payloads are not restored, the broker may have lost them while stopped.
+
+        Returns:
+            bool: True if the Site registry was restored
+        """
+        if self.store is None:
+            return False
+        try:
+            # Published events are restored even on a cold start, so they are not published again
+            load_history_dedup(entries=self.store.items("history"))
+            load_history_cursors(cursors=self.store.items("history_cursor"))
+            sites = [Site(**site) for site in self.store.items("sites").values()]
+            if not sites:
+                return False
+            self.api.load_site_registry(sites=sites)
+            load_payloads(
+                payloads=self.store.items("polling"),
+                loaders={"devices": lambda items: [Device(**item) for item in items or []]},
+            )
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.warning(f"Unable to restore state, starting cold: {exp}")
+            return False
+        LOGGER.info(f"Restored state of {len(sites)} Site(s)")
+        return True
+
+    def save_state(self) -> None:
+        """Save the last known state, never calls the API"""
+        if self.store is None:
+            return
+        try:
+            self.store.replace(
+                "sites",
+                {
+                    # Secrets (camera token) are not written to disk, they come back with the next Sites fetch
+                    site_id: {slot: None if is_secret(slot) else getattr(site, slot, None) for slot in site.__slots__}
+                    for site_id, site in self.api.get_cached_sites().items()
+                },
+            )
+            self.store.replace("polling", export_payloads())
+            self.store.replace("history", export_history_dedup())
+            self.store.replace("history_cursor", export_history_cursors())
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.warning(f"Unable to save state: {exp}")
+
+    def reconcile(self) -> None:
+        """Reconcile the restored state with the API"""
+        try:
+            # Sites may have been added or removed while stopped
+            self.select_sites(list(self.api.get_site_registry(force=True).values()))
+            self.configure()
+        except Exception as exp:  # pylint: disable=broad-except
+            LOGGER.warning(f"Error while reconciling state: {exp}")
+
+    def configure(self) -> None:
+        """Publish Home Assistant configuration"""
+        with self.api.priority(Priority.BACKGROUND):
+            ha_sites_config(
                 api=self.api,
                 mqtt_client=self.mqtt_client,
                 mqtt_config=self.mqtt_config,
                 my_sites_id=self.my_sites_id,
+                homeassistant_config=self.homeassistant_config,
+            )
+            ha_devices_config(
+                api=self.api,
+                mqtt_client=self.mqtt_client,
+                mqtt_config=self.mqtt_config,
+                my_sites_id=self.my_sites_id,
+                discovery_cache=self.discovery_cache,
             )
-        update_devices_status(
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-        )
 
-        # Schedule Refreshs
-        schedule.every(self.delay_site).seconds.do(
-            update_sites_status,
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-        )
-        schedule.every(self.delay_device).seconds.do(
-            update_devices_status,
-            api=self.api,
-            mqtt_client=self.mqtt_client,
-            mqtt_config=self.mqtt_config,
-            my_sites_id=self.my_sites_id,
-        )
+    def jobs(self) -> List[Tuple[int, Callable]]:
+        """Refresh Jobs
+
+        Returns:
+            List[Tuple[int, Callable]]: (interval, all sites refresh)
+        """
+        # Each endpoint family is only polled when due, see business.polling
+        jobs = [
+            (polling_tick(), update_sites_status),
+        ]
         if not self.manual_snapshot:
-            schedule.every(self.delay_device).seconds.do(
-                update_camera_snapshot,
-                api=self.api,
+            # Each camera is only refreshed when due, see business.snapshot
+            jobs.append((snapshot_intervals()["active"], update_camera_snapshot))
+        jobs.append((polling_tick(), update_devices_status))
+        return jobs
+
+    def job_kwargs(self) -> Dict[str, Any]:
+        """Arguments shared by every refresh job"""
+        return {
+            "api": self.api,
+            "mqtt_client": self.mqtt_client,
+            "mqtt_config": self.mqtt_config,
+        }
+
+    def loop(self) -> None:
+        """Main Loop"""
+        self.api.start_sites_refresh()
+        # Config
+        if self.warm:
+            # Restored families are not due yet, publish their last payloads meanwhile
+            publish_restored_state(
                 mqtt_client=self.mqtt_client,
                 mqtt_config=self.mqtt_config,
+                my_sites_id=list(self.my_sites_id),
+            )
+            threading.Thread(target=self.reconcile, name="myfox-reconcile", daemon=True).start()
+        else:
+            self.configure()
+
+        # Device Update (First Run Only)
+        for _, refresh in self.jobs():
+            refresh(my_sites_id=self.my_sites_id, **self.job_kwargs())
+
+        # Schedule Refreshs
+        for interval, refresh in self.jobs():
+            schedule.every(interval).seconds.do(
+                refresh,
+                my_sites_id=self.my_sites_id,
+                **self.job_kwargs(),
+            )
+        if self.store is not None:
+            schedule.every(self.state_store_interval).seconds.do(self.save_state)
+        if diagnostics_enabled():
+            schedule.every(diagnostics_interval()).seconds.do(
+                publish_diagnostics,
                 my_sites_id=self.my_sites_id,
+                **self.job_kwargs(),
             )
 
         while True:
@@ -0,0 +1,10 @@
+"""Tests Configuration"""
+
+import os
+import sys
+
+# Modules are imported from the application directory, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# business and mqtt import each other, load them in the order main.py does
+import business  # noqa: E402,F401 pylint: disable=unused-import,wrong-import-position
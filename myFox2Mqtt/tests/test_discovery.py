@@ -0,0 +1,107 @@
+"""Home Assistant Discovery Tests"""
+
+# pylint: disable=redefined-outer-name
+
+from types import SimpleNamespace
+
+import pytest
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+
+from business import publish_discovery
+from business.mqtt import DISCOVERY_CONFIGS, republish_discovery
+from homeassistant.discovery_cache import discovery_digest, read_discovery_digests, write_discovery_digests
+
+DOOR = "homeassistant/binary_sensor/site_door/state/config"
+WINDOW = "homeassistant/binary_sensor/site_window/state/config"
+OTHER_SITE = "homeassistant/binary_sensor/other_shutter/state/config"
+
+
+class FakeClient:
+    """paho client recording publishes"""
+
+    def __init__(self):
+        self.published = []
+        self.rc = MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload, qos, retain))
+        return SimpleNamespace(rc=self.rc)
+
+
+@pytest.fixture
+def mqtt_client():
+    DISCOVERY_CONFIGS.clear()
+    yield SimpleNamespace(config={}, client=FakeClient())
+    DISCOVERY_CONFIGS.clear()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "discovery.json")
+
+
+def topics(mqtt_client):
+    return [topic for topic, *_ in mqtt_client.client.published]
+
+
+def test_digest_is_stable():
+    assert discovery_digest({"a": 1, "b": [1, 2]}) == discovery_digest({"b": [1, 2], "a": 1})
+    assert discovery_digest({"a": 1}) != discovery_digest({"a": 2})
+
+
+def test_first_run_publishes_everything(mqtt_client, cache_path):
+    discovery = {DOOR: {"name": "Door"}, WINDOW: {"name": "Window"}}
+    publish_discovery(mqtt_client=mqtt_client, discovery=discovery, cache_path=cache_path)
+    assert sorted(topics(mqtt_client)) == sorted(discovery)
+    # Retained, QoS 1
+    assert all(qos == 1 and retain for _, _, qos, retain in mqtt_client.client.published)
+    digests = {topic: discovery_digest(config) for topic, config in discovery.items()}
+    assert read_discovery_digests(cache_path) == digests
+
+
+def test_only_changes_are_published(mqtt_client, cache_path):
+    write_discovery_digests({DOOR: discovery_digest({"name": "Door"}), WINDOW: "old"}, cache_path=cache_path)
+    discovery = {DOOR: {"name": "Door"}, WINDOW: {"name": "Window"}}
+    publish_discovery(mqtt_client=mqtt_client, discovery=discovery, cache_path=cache_path)
+    assert topics(mqtt_client) == [WINDOW]
+    # Unchanged configs are still republished on reconnect
+    assert set(DISCOVERY_CONFIGS) == {DOOR, WINDOW}
+
+
+def test_vanished_configs_are_removed(mqtt_client, cache_path):
+    write_discovery_digests({DOOR: discovery_digest({"name": "Door"}), WINDOW: "old"}, cache_path=cache_path)
+    publish_discovery(mqtt_client=mqtt_client, discovery={DOOR: {"name": "Door"}}, cache_path=cache_path)
+    assert mqtt_client.client.published == [(WINDOW, "", 1, True)]
+    assert read_discovery_digests(cache_path) == {DOOR: discovery_digest({"name": "Door"})}
+
+
+def test_unavailable_sites_are_kept(mqtt_client, cache_path):
+    write_discovery_digests({DOOR: "door", OTHER_SITE: "shutter"}, cache_path=cache_path)
+    publish_discovery(
+        mqtt_client=mqtt_client,
+        discovery={DOOR: {"name": "Door"}},
+        cache_path=cache_path,
+        unavailable_sites=["other"],
+    )
+    assert topics(mqtt_client) == [DOOR]
+    assert read_discovery_digests(cache_path)[OTHER_SITE] == "shutter"
+
+
+def test_failed_publishes_are_retried(mqtt_client, cache_path):
+    write_discovery_digests({WINDOW: "old"}, cache_path=cache_path)
+    mqtt_client.client.rc = MQTT_ERR_NO_CONN
+    publish_discovery(mqtt_client=mqtt_client, discovery={DOOR: {"name": "Door"}}, cache_path=cache_path)
+    # Neither the new config nor the removal is recorded
+    assert read_discovery_digests(cache_path) == {WINDOW: "old"}
+
+    mqtt_client.client.rc = MQTT_ERR_SUCCESS
+    mqtt_client.client.published.clear()
+    publish_discovery(mqtt_client=mqtt_client, discovery={DOOR: {"name": "Door"}}, cache_path=cache_path)
+    assert sorted(topics(mqtt_client)) == sorted([DOOR, WINDOW])
+
+
+def test_republish_discovery(mqtt_client, cache_path):
+    publish_discovery(mqtt_client=mqtt_client, discovery={DOOR: {"name": "Door"}}, cache_path=cache_path)
+    mqtt_client.client.published.clear()
+    republish_discovery(mqtt_client=mqtt_client)
+    assert topics(mqtt_client) == [DOOR]
@@ -0,0 +1,66 @@
+"""MQTT Command Dispatcher Tests"""
+
+# pylint: disable=protected-access
+
+import threading
+from types import SimpleNamespace
+
+from mqtt.dispatcher import CommandDispatcher
+
+
+def dispatcher(prefix="myFox2mqtt", handler=None, **kwargs):
+    return CommandDispatcher(handler=handler or (lambda msg: None), prefix=prefix, **kwargs)
+
+
+def test_alarm_commands_on_priority_queue():
+    commands = dispatcher()
+    assert commands._queue_for("myFox2mqtt/site/command") is commands.priority_queue
+    assert commands._queue_for("myFox2mqtt/site/device/command") is not commands.priority_queue
+
+
+def test_prefix_with_slashes():
+    commands = dispatcher(prefix="home/myfox/")
+    assert commands._queue_for("home/myfox/site/command") is commands.priority_queue
+    assert commands._queue_for("home/myfox/site/device/shutter") is commands._queue_for(
+        "home/myfox/site/device/command"
+    )
+
+
+def test_same_device_same_queue():
+    commands = dispatcher(workers=8)
+    queue = commands._queue_for("myFox2mqtt/site/device/command")
+    assert commands._queue_for("myFox2mqtt/site/device/snapshot") is queue
+    queues = {id(commands._queue_for(f"myFox2mqtt/site/device{index}/command")) for index in range(50)}
+    assert len(queues) > 1
+
+
+def test_unexpected_topic():
+    commands = dispatcher()
+    assert commands._queue_for("other/site/command") is commands.priority_queue
+
+
+def test_commands_processed_in_order():
+    done = threading.Event()
+    handled = []
+
+    def handler(msg):
+        handled.append(msg.payload)
+        if len(handled) == 5:
+            done.set()
+
+    commands = dispatcher(handler=handler, workers=2)
+    for index in range(5):
+        assert commands.submit(SimpleNamespace(topic="myFox2mqtt/site/device/command", payload=index))
+    assert done.wait(5)
+    assert handled == [0, 1, 2, 3, 4]
+
+
+def test_full_queue_drops_commands():
+    release = threading.Event()
+    commands = dispatcher(handler=lambda msg: release.wait(5), workers=1, queue_size=1)
+    msg = SimpleNamespace(topic="myFox2mqtt/site/device/command", payload=b"")
+    # First one is taken by the worker, the second one fills the queue
+    accepted = [commands.submit(msg) for _ in range(4)]
+    release.set()
+    assert not all(accepted)
+    assert commands.metrics()["dropped"] >= 1
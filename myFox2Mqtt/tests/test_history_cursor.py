@@ -0,0 +1,168 @@
+"""History Cursor Tests"""
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+import logging
+from datetime import datetime, timezone
+from time import time
+
+import pytest
+
+from business import refresh_site_status
+from business.history import (
+    CREATED_AT_FORMAT,
+    HISTORY_CURSORS,
+    advance_history_cursor,
+    export_history_cursors,
+    fetch_new_events,
+    history_cursor,
+    init_history,
+    load_history_cursors,
+)
+from business.polling import init_polling, poll_now
+
+
+def created_at(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(CREATED_AT_FORMAT)
+
+
+class FakeApi:
+    """History API returning newest events first, by pages"""
+
+    def __init__(self, epochs, page_size=3, paginated=True):
+        self.events = [{"logId": str(epoch), "createdAt": created_at(epoch)} for epoch in sorted(epochs, reverse=True)]
+        self.page_size = page_size
+        self.paginated = paginated
+        self.offsets = []
+
+    def get_site_history(self, site_id, offset=0):
+        self.offsets.append(offset)
+        if not self.paginated:
+            offset = 0
+        return self.events[offset : offset + self.page_size]
+
+
+@pytest.fixture(autouse=True)
+def reset_history():
+    init_history(config={"max_pages": 5, "max_age": 90})
+    HISTORY_CURSORS.clear()
+    yield
+    HISTORY_CURSORS.clear()
+    init_history(config=None)
+
+
+def test_first_poll_only_recent_events():
+    now = int(time())
+    api = FakeApi([now - 3600, now - 30, now - 10])
+    events = fetch_new_events(api=api, site_id="site")
+    assert [event["logId"] for _, event in events] == [str(now - 30), str(now - 10)]
+    # Oldest first, only one page without cursor
+    assert api.offsets == [0]
+
+
+def test_first_poll_without_event_sets_cursor():
+    now = time()
+    assert fetch_new_events(api=FakeApi([]), site_id="site") == []
+    assert history_cursor("site") == pytest.approx(now - 90, abs=5)
+
+
+def test_cursor_not_advanced_by_fetch():
+    advance_history_cursor("site", 1000.0)
+    events = fetch_new_events(api=FakeApi([900, 1000, 1100, 1200]), site_id="site")
+    assert [epoch for epoch, _ in events] == [1000, 1100, 1200]
+    # Advanced by the caller once each event is published
+    assert history_cursor("site") == 1000.0
+
+
+def test_catch_up_over_pages(caplog):
+    advance_history_cursor("site", 1000.0)
+    api = FakeApi(range(995, 1010), page_size=3)
+    with caplog.at_level(logging.WARNING):
+        events = fetch_new_events(api=api, site_id="site")
+    assert [epoch for epoch, _ in events] == list(range(1000, 1010))
+    assert api.offsets == [0, 3, 6, 9]
+    assert "not reached" not in caplog.text
+
+
+def test_warns_when_cursor_not_reached(caplog):
+    init_history(config={"max_pages": 2})
+    advance_history_cursor("site", 1000.0)
+    api = FakeApi(range(1000, 1010), page_size=3)
+    with caplog.at_level(logging.WARNING):
+        events = fetch_new_events(api=api, site_id="site")
+    assert len(events) == 6
+    assert "not reached after 2 page(s)" in caplog.text
+
+
+def test_no_warning_when_history_exhausted(caplog):
+    advance_history_cursor("site", 1000.0)
+    with caplog.at_level(logging.WARNING):
+        fetch_new_events(api=FakeApi(range(1001, 1005), page_size=3), site_id="site")
+    assert "not reached" not in caplog.text
+
+
+def test_pagination_not_honoured(caplog):
+    advance_history_cursor("site", 1000.0)
+    api = FakeApi(range(1001, 1010), page_size=3, paginated=False)
+    with caplog.at_level(logging.WARNING):
+        events = fetch_new_events(api=api, site_id="site")
+    # The repeated page is not handled twice
+    assert len(events) == 3
+    assert api.offsets == [0, 3]
+    assert "not reached after 1 page(s)" in caplog.text
+
+
+def test_cursor_only_moves_forward():
+    advance_history_cursor("site", 1000.0)
+    advance_history_cursor("site", 900.0)
+    assert history_cursor("site") == 1000.0
+    advance_history_cursor("site", 1100.0)
+    assert export_history_cursors() == {"site": 1100.0}
+
+
+def test_load_cursors():
+    load_history_cursors({"site": "1000.5"})
+    assert history_cursor("site") == 1000.5
+
+
+class FakeClient:
+    """paho client failing after a number of publishes"""
+
+    def __init__(self, fail_after):
+        self.fail_after = fail_after
+        self.topics = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if len(self.topics) >= self.fail_after:
+            raise OSError("broker gone")
+        self.topics.append(topic)
+
+
+class FakeMqttClient:
+    def __init__(self, fail_after):
+        self.config = {}
+        self.client = FakeClient(fail_after=fail_after)
+
+
+class FakeSiteApi(FakeApi):
+    def get_cached_site(self, site_id):
+        return None
+
+    def get_site_status(self, site_id):
+        return {"payload": {"statusLabel": "disarmed"}}
+
+
+def test_events_caught_up_after_publish_failure():
+    init_polling(config=None, delay_site=60, delay_device=60)
+    advance_history_cursor("site", 1000.0)
+    api = FakeSiteApi([1001, 1002])
+    # history/events and history topics of the first event only
+    mqtt_client = FakeMqttClient(fail_after=2)
+    refresh_site_status(api=api, mqtt_client=mqtt_client, mqtt_config={}, site_id="site")
+    assert history_cursor("site") == 1001.0
+
+    mqtt_client.client.fail_after = 10
+    poll_now("site", "history")
+    refresh_site_status(api=api, mqtt_client=mqtt_client, mqtt_config={}, site_id="site")
+    assert history_cursor("site") == 1002.0
+    assert mqtt_client.client.topics.count("myFox2mqtt/site/history/events") == 2
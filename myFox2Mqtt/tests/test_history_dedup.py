@@ -0,0 +1,93 @@
+"""History Dedup Tests"""
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+import pytest
+
+from business import history
+from business.history import EventDedup, event_identity, event_published, init_history, remember_event
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(history, "time", lambda: now[0])
+    return now
+
+
+def test_identity_from_event_id():
+    assert event_identity("site", {"logId": "42", "createdAt": "2024-01-01T00:00:00Z"}) == "site:42"
+
+
+def test_identity_without_event_id():
+    event = {"createdAt": "2024-01-01T00:00:00Z", "type": "alarm", "label": "Door"}
+    assert event_identity("site", event) == event_identity("site", dict(event))
+    # Events sharing a timestamp don't collide
+    assert event_identity("site", event) != event_identity("site", dict(event, label="Window"))
+    assert event_identity("site", event) != event_identity("other", event)
+
+
+def test_seen(clock):
+    dedup = EventDedup(ttl=60)
+    assert not dedup.seen("a")
+    assert dedup.seen("a")
+    assert dedup.hits == 1
+
+
+def test_seen_without_remember(clock):
+    dedup = EventDedup(ttl=60)
+    assert not dedup.seen("a", remember=False)
+    assert not dedup.seen("a")
+    assert dedup.seen("a", remember=False)
+
+
+def test_ttl(clock):
+    dedup = EventDedup(ttl=60)
+    dedup.seen("a")
+    clock[0] += 59
+    assert dedup.seen("a")
+    clock[0] += 2
+    assert not dedup.seen("a")
+    assert dedup.expired == 1
+
+
+def test_eviction_oldest_first(clock):
+    dedup = EventDedup(ttl=60, max_entries=2)
+    for identity in ("a", "b", "c"):
+        dedup.seen(identity)
+    assert dedup.evicted == 1
+    assert list(dedup.export()) == ["b", "c"]
+    assert not dedup.seen("a")
+
+
+def test_export_and_load(clock):
+    dedup = EventDedup(ttl=60)
+    dedup.seen("a")
+    clock[0] += 30
+    dedup.seen("b")
+    entries = dedup.export()
+    assert entries == {"a": 1060.0, "b": 1090.0}
+
+    restored = EventDedup(ttl=60, max_entries=1)
+    clock[0] += 40
+    restored.load(dict(entries, c=900.0))
+    # Expired entries are dropped, then the oldest ones once full
+    assert restored.export() == {"b": 1090.0}
+
+
+def test_metrics():
+    dedup = EventDedup()
+    dedup.seen("a")
+    metrics = dedup.metrics()
+    assert metrics["entries"] == 1
+    assert metrics["bytes"] > 0
+
+
+def test_event_published_then_remembered():
+    init_history(config={"dedup_ttl": 60})
+    event = {"logId": "1"}
+    assert not event_published("site", event)
+    assert not event_published("site", event)
+    remember_event("site", event)
+    assert event_published("site", event)
+    init_history(config=None)
@@ -0,0 +1,54 @@
+"""Metrics Tests"""
+
+from utils.metrics import Counter, Gauge, Histogram, expose, path_template
+
+
+def test_path_template():
+    assert path_template("/v2/site/5cf0e2e2a1f3b20007fe4a1c/device/5cf0e2e2a1f3b20007fe4a1d") == (
+        "/v2/site/{id}/device/{id}"
+    )
+    assert path_template("/v2/site/5cf0e2e2a1f3b20007fe4a1c/security") == "/v2/site/{id}/security"
+    # Plain words are kept
+    assert path_template("/v2/client/site") == "/v2/client/site"
+    assert path_template("/v2/site/1234/history") == "/v2/site/1234/history"
+
+
+def test_counter():
+    counter = Counter("test_counter_total", "Test counter", ["reason"])
+    counter.inc(reason="timeout")
+    counter.inc(2, reason="http_500")
+    assert counter.total() == 3
+    assert 'test_counter_total{reason="http_500"} 2.0' in counter.samples()
+
+
+def test_label_escaping():
+    counter = Counter("test_escaped_total", "Test counter", ["path"])
+    counter.inc(path='a"b\\c')
+    assert counter.samples() == ['test_escaped_total{path="a\\"b\\\\c"} 1.0']
+
+
+def test_gauge_callback_errors_are_skipped():
+    gauge = Gauge("test_gauge", "Test gauge", ["name"])
+    gauge.set_function(lambda: 4, name="ok")
+    gauge.set_function(lambda: 1 / 0, name="broken")
+    assert gauge.samples() == ['test_gauge{name="ok"} 4.0']
+
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "Test histogram", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.total() == (4, 6.05)
+    assert histogram.samples() == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_count 4",
+        "test_seconds_sum 6.05",
+    ]
+
+
+def test_expose():
+    text = expose()
+    assert "# TYPE myfox_api_request_seconds histogram" in text
+    assert text.endswith("\n")
@@ -0,0 +1,51 @@
+"""Payload Logging Tests"""
+
+import json
+import logging
+
+from utils.payload_log import REDACTED, LazyPayload, init_payload_logging, log_payload, redact
+
+
+def test_redact_nested_secrets():
+    payload = {
+        "siteId": "1",
+        "arcsoftToken": "secret",
+        "devices": [{"label": "Camera", "access_token": "secret"}],
+        "Authorization": "Bearer secret",
+    }
+    assert redact(payload) == {
+        "siteId": "1",
+        "arcsoftToken": REDACTED,
+        "devices": [{"label": "Camera", "access_token": REDACTED}],
+        "Authorization": REDACTED,
+    }
+    # The original payload is left untouched
+    assert payload["arcsoftToken"] == "secret"
+
+
+def test_lazy_payload_from_json_bytes():
+    assert json.loads(str(LazyPayload(b'{"password": "secret", "a": 1}'))) == {"password": REDACTED, "a": 1}
+
+
+def test_lazy_payload_not_json():
+    assert str(LazyPayload(b"\xffnot json")).endswith("not json")
+    assert str(LazyPayload("plain text")) == "plain text"
+
+
+def test_log_payload_levels(caplog):
+    logger = logging.getLogger("tests.payload")
+    init_payload_logging(config={"sample_rate": 0})
+    with caplog.at_level(logging.INFO, logger="tests.payload"):
+        log_payload(logger, "Site", {"token": "secret"})
+    assert not caplog.records
+
+    init_payload_logging(config={"sample_rate": 5})
+    with caplog.at_level(logging.INFO, logger="tests.payload"):
+        log_payload(logger, "Site", {"token": "secret"})
+    assert "(sampled)" in caplog.text
+    assert "secret" not in caplog.text
+
+    with caplog.at_level(logging.DEBUG, logger="tests.payload"):
+        log_payload(logger, "Site", {"token": "secret", "label": "Home"})
+    assert "Home" in caplog.text
+    init_payload_logging(config=None)
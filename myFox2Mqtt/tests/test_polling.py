@@ -0,0 +1,102 @@
+"""Adaptive Polling Tests"""
+
+import pytest
+
+from business import polling
+from business.polling import (
+    AdaptiveInterval,
+    MIN_INTERVAL,
+    POLLING_BOUNDS,
+    due_families,
+    export_payloads,
+    init_polling,
+    last_payload,
+    load_payloads,
+    observe,
+    poll_now,
+    polling_tick,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_polling():
+    init_polling(config=None, delay_site=60, delay_device=60)
+    polling.POLLED_AT.clear()
+    yield
+    init_polling(config=None, delay_site=60, delay_device=60)
+
+
+def test_backoff_while_stable():
+    interval = AdaptiveInterval(minimum=10, maximum=40)
+    assert interval.observe({"a": 1}, now=0)
+    assert interval.interval == 10
+    assert not interval.observe({"a": 1}, now=10)
+    assert interval.interval == 20
+    interval.observe({"a": 1}, now=30)
+    interval.observe({"a": 1}, now=70)
+    assert interval.interval == 40
+    assert interval.next_at == 110
+
+
+def test_reset_on_change():
+    interval = AdaptiveInterval(minimum=10, maximum=40)
+    for now in (0, 10, 30):
+        interval.observe([1, 2], now=now)
+    assert interval.interval == 40
+    assert interval.observe([2, 1], now=70)
+    assert interval.interval == 10
+    assert interval.payload == [2, 1]
+
+
+def test_digest_ignores_key_order():
+    interval = AdaptiveInterval(minimum=10, maximum=40)
+    interval.observe({"a": 1, "b": 2}, now=0)
+    assert not interval.observe({"b": 2, "a": 1}, now=10)
+
+
+def test_due_tolerates_jitter():
+    interval = AdaptiveInterval(minimum=10, maximum=10)
+    interval.observe(1, now=0)
+    assert not interval.due(8)
+    assert interval.due(9.5)
+
+
+def test_default_bounds():
+    # Primary states are not backed off unless configured
+    for family in ("site_status", "history", "devices", "state"):
+        assert POLLING_BOUNDS[family]["max"] == POLLING_BOUNDS[family]["min"] == 60
+    assert POLLING_BOUNDS["temperature"]["max"] == 1800
+
+
+def test_configured_bounds():
+    init_polling(
+        config={"state": {"min": 1, "max": 120}, "light": {"min": 300, "max": 100}},
+        delay_site=60,
+        delay_device=60,
+    )
+    assert POLLING_BOUNDS["state"]["min"] == MIN_INTERVAL
+    assert POLLING_BOUNDS["state"]["max"] == 120
+    # max is never below min
+    assert POLLING_BOUNDS["light"]["max"] == 300
+    assert polling_tick() == MIN_INTERVAL
+
+
+def test_due_families_and_poll_now():
+    assert due_families("site", ["state", "devices"]) == ["state", "devices"]
+    observe("site", "state", {"open": True})
+    assert due_families("site", ["state", "devices"]) == ["devices"]
+    poll_now("site", "state")
+    assert due_families("site", ["state"]) == ["state"]
+    assert last_payload("site", "state") == {"open": True}
+
+
+def test_export_and_load_payloads():
+    observe("site", "state", [{"deviceId": "1", "stateLabel": "opened"}])
+    payloads = export_payloads()
+    assert payloads == {"site|state": [{"deviceId": "1", "stateLabel": "opened"}]}
+
+    init_polling(config=None, delay_site=60, delay_device=60)
+    load_payloads(payloads, loaders={"state": lambda items: [dict(item, restored=True) for item in items]})
+    assert last_payload("site", "state") == [{"deviceId": "1", "stateLabel": "opened", "restored": True}]
+    # Restored families are next polled after their min interval
+    assert due_families("site", ["state"]) == []
@@ -0,0 +1,75 @@
+"""Rate Limit Tests"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from myfox.api.ratelimit import Priority, RateLimiter, parse_retry_after
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("-5") == 0
+
+
+def test_parse_retry_after_default():
+    assert parse_retry_after(None) == 60
+    assert parse_retry_after("soon", default=30) == 30
+
+
+def test_parse_retry_after_http_date():
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=90), usegmt=True)
+    assert 85 <= parse_retry_after(date) <= 90
+
+
+def test_disabled_by_default():
+    limiter = RateLimiter()
+    assert not limiter.enabled
+    assert limiter.acquire(Priority.BACKGROUND) == 0.0
+
+
+def test_reserves_keep_tokens_for_commands():
+    limiter = RateLimiter({"requests_per_minute": 1, "burst": 10})
+    # Background may only use the half of the bucket above its reserve
+    for _ in range(5):
+        assert limiter.acquire(Priority.BACKGROUND) < 0.1
+    assert 4.9 < limiter.tokens < 5.1
+    assert limiter.acquire(Priority.COMMAND) < 0.1
+
+
+def test_custom_reserves():
+    limiter = RateLimiter({"requests_per_minute": 60, "burst": 10, "reserves": {"background": 0.2}})
+    assert limiter.reserves[Priority.BACKGROUND] == 0.2
+    assert limiter.reserves[Priority.DEVICE] == 0.25
+
+
+def test_pause_empties_the_bucket():
+    limiter = RateLimiter({"requests_per_minute": 60, "burst": 10})
+    limiter.pause(60)
+    assert limiter.tokens == 0
+
+
+def test_no_refill_while_paused():
+    limiter = RateLimiter({"requests_per_minute": 60, "burst": 10})
+    limiter.tokens = 0
+    limiter.updated_at = 100.0
+    limiter.paused_until = 110.0
+    limiter._refill(105.0)  # pylint: disable=protected-access
+    assert limiter.tokens == 0
+    # Tokens are earned from the end of the pause only
+    limiter._refill(112.0)  # pylint: disable=protected-access
+    assert limiter.tokens == 2
+
+
+def test_refill_capped_by_burst():
+    limiter = RateLimiter({"requests_per_minute": 60, "burst": 10})
+    limiter.tokens = 0
+    limiter.updated_at = 0.0
+    limiter._refill(1000.0)  # pylint: disable=protected-access
+    assert limiter.tokens == 10
+
+
+def test_pause_applies_when_disabled():
+    limiter = RateLimiter()
+    limiter.pause(0.1)
+    assert limiter.acquire(Priority.COMMAND) >= 0.05
+    assert limiter.acquire(Priority.COMMAND) == 0.0
@@ -1,38 +1,103 @@
 """Utils package"""
 
+import atexit
 import codecs
 import logging
 import logging.handlers
 import os
-from typing import Any, Dict
+import queue
+from typing import Any, Dict, Optional
 import sys
 
 import yaml
 from yaml.parser import ParserError
 
+from utils.codec import dumps
+
 LOGGER = logging.getLogger(__name__)
 
+LOG_FORMAT = "%(asctime)s [%(levelname)s] [%(name)s:%(lineno)d] %(message)s"
+LOG_LISTENER = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "thread": record.threadName,
+            # Includes the traceback, formatted by the QueueHandler
+            "message": record.getMessage(),
+        }
+        return dumps(entry, default=str).decode("utf8")
+
 
-def setup_logger(filename: str, debug: bool = False) -> None:
+def setup_logger(filename: str, debug: bool = False, config: Optional[Dict[str, Any]] = None) -> None:
     """Setup Logging
+
+    Records are queued by the logging threads and written by a single listener thread,
+    so log I/O never blocks MQTT callbacks or API polling.
+
     Args:
         debug (bool, optional): True if debug enabled. Defaults to False.
         filename (str, optional): log filename. Defaults to "/var/log/myFox.log".
+        config (Optional[Dict[str, Any]], optional): Logging Configuration (rotation, json). Defaults to None.
     """
+    global LOG_LISTENER  # pylint: disable=global-statement
+    config = config or {}
     log_level = logging.DEBUG if debug else logging.INFO
+    formatter = logging.Formatter(LOG_FORMAT)
     handlers = [
         logging.StreamHandler(),
     ]
+    handlers[0].setFormatter(formatter)
     if filename:
-        handlers.append(logging.FileHandler(filename=filename))
+        rotation = config.get("rotation", "size")
+        backup_count = int(config.get("backup_count", 5))
+        if rotation == "size":
+            file_handler = logging.handlers.RotatingFileHandler(
+                filename=filename,
+                maxBytes=int(config.get("max_bytes", 10 * 1024 * 1024)),
+                backupCount=backup_count,
+                encoding="utf8",
+            )
+        elif rotation == "time":
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                filename=filename,
+                when=config.get("when", "midnight"),
+                backupCount=backup_count,
+                encoding="utf8",
+            )
+        else:
+            file_handler = logging.FileHandler(filename=filename, encoding="utf8")
+        file_handler.setFormatter(JsonLinesFormatter() if config.get("json") else formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    LOG_LISTENER = logging.handlers.QueueListener(log_queue, *handlers)
+    LOG_LISTENER.start()
+    atexit.register(stop_logger)
 
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
     logging.basicConfig(
         level=log_level,
-        format="%(asctime)s [%(levelname)s] [%(name)s:%(lineno)d] %(message)s",
-        handlers=handlers,
+        handlers=[queue_handler],
     )
 
 
+def stop_logger() -> None:
+    """Write queued records and stop the logging listener"""
+    global LOG_LISTENER  # pylint: disable=global-statement
+    if LOG_LISTENER is not None:
+        LOG_LISTENER.stop()
+        LOG_LISTENER = None
+
+
 def read_config_file(config_file: str) -> Dict[str, Any]:
     """Read config file
 
@@ -77,4 +142,5 @@ def close_and_exit(
     LOGGER.info("Stopping Application")
     if robot:
         robot.close()
+    stop_logger()
     sys.exit(code)
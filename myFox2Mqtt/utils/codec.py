@@ -0,0 +1,53 @@
+"""JSON Codec
+
+orjson is used when installed, the stdlib json module otherwise.
+"""
+
+import json
+from json import JSONDecodeError
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+__all__ = ["BACKEND", "JSONDecodeError", "dumps", "loads"]
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Serialize to UTF-8 JSON
+
+    Args:
+        obj (Any): Object to serialize
+        sort_keys (bool, optional): Sort dict keys (stable output). Defaults to False.
+        default (Optional[Callable[[Any], Any]], optional): Fallback for unsupported objects. Defaults to None.
+
+    Returns:
+        bytes: JSON
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=default).encode("utf8")
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """Parse JSON
+
+    Args:
+        data (Union[bytes, bytearray, str]): JSON
+
+    Raises:
+        JSONDecodeError: Invalid JSON
+
+    Returns:
+        Any: Parsed object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
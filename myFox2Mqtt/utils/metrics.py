@@ -0,0 +1,247 @@
+"""Prometheus Metrics
+
+Minimal stdlib implementation of counters, gauges and histograms, exposed in the
+Prometheus text format by an optional HTTP endpoint.
+"""
+
+import bisect
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ID_SEGMENT = re.compile(r"/(?=[A-Za-z0-9_-]*\d)[A-Za-z0-9_-]{12,}(?=/|$)")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_LOCK = threading.Lock()
+REGISTRY = []  # type: List[Metric]
+METRICS_SERVER = None
+
+
+def path_template(path: str) -> str:
+    """Replace Site, Device and User IDs of a path, ie /v2/site/{id}/device/{id}
+
+    Args:
+        path (str): Path
+
+    Returns:
+        str: Path template
+    """
+    return ID_SEGMENT.sub("/{id}", path)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """Metric with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        with METRICS_LOCK:
+            REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        """Sample lines"""
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        """Metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self.values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increment the counter"""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def total(self) -> float:
+        """Sum of every label set"""
+        with self.lock:
+            return sum(self.values.values())
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Gauge(Metric):
+    """Value read from a callback when exposed"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self.callbacks = {}  # type: Dict[Tuple[str, ...], Callable[[], float]]
+
+    def set_function(self, callback: Callable[[], float], **labels: str) -> None:
+        """Read the gauge from a callback"""
+        with self.lock:
+            self.callbacks[self._key(labels)] = callback
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            callbacks = dict(self.callbacks)
+        lines = []
+        for key, callback in callbacks.items():
+            try:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {float(callback())}")
+            except Exception as exp:  # pylint: disable=broad-except
+                LOGGER.debug(f"Unable to read {self.name}: {exp}")
+        return lines
+
+
+class Histogram(Metric):
+    """Cumulative histogram"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels => (count per bucket, +Inf included, sum)
+        self.values = {}  # type: Dict[Tuple[str, ...], Tuple[List[int], float]]
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record a value"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def total(self) -> Tuple[int, float]:
+        """Count and sum of every label set"""
+        with self.lock:
+            return (
+                sum(sum(counts) for counts, _ in self.values.values()),
+                sum(total for _, total in self.values.values()),
+            )
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+API_REQUEST_SECONDS = Histogram(
+    "myfox_api_request_seconds", "MyFox API request latency, retries included", ["method", "path"]
+)
+API_ERRORS = Counter("myfox_api_errors_total", "MyFox API failed requests", ["method", "path", "reason"])
+TOKEN_REFRESHES = Counter("myfox_token_refreshes_total", "MyFox API token refreshes")
+MQTT_PUBLISHED = Counter("myfox_mqtt_published_total", "MQTT publishes", ["retained"])
+MQTT_PUBLISHED_BYTES = Counter("myfox_mqtt_published_bytes_total", "MQTT published payload bytes", ["retained"])
+MQTT_SKIPPED = Counter("myfox_mqtt_skipped_total", "Unchanged retained payloads not published")
+REFRESH_CYCLE_SECONDS = Histogram(
+    "myfox_refresh_cycle_seconds", "Refresh of every Site", ["job"], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+SITE_REFRESH_SECONDS = Histogram(
+    "myfox_site_refresh_seconds", "Refresh of one Site", ["job"], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+SNAPSHOT_BYTES = Counter("myfox_snapshot_bytes_total", "Downloaded camera snapshot bytes")
+COMMAND_WAIT_SECONDS = Histogram(
+    "myfox_command_queue_wait_seconds", "Time MQTT commands waited in the command queue", buckets=(0.01, 0.1, 0.5, 1, 5)
+)
+COMMAND_QUEUE_DEPTH = Gauge("myfox_command_queue_depth", "MQTT commands waiting to be processed")
+
+
+def expose() -> str:
+    """Every metric in the Prometheus text format"""
+    with METRICS_LOCK:
+        metrics = list(REGISTRY)
+    return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics"""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Handle GET"""
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = expose().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+        LOGGER.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+
+def start_metrics_server(config: Optional[Dict]) -> Optional[ThreadingHTTPServer]:
+    """Start the metrics endpoint, if enabled
+
+    Args:
+        config (Optional[Dict]): Metrics Configuration (enabled, host, port)
+
+    Returns:
+        Optional[ThreadingHTTPServer]: Server, None if disabled
+    """
+    global METRICS_SERVER  # pylint: disable=global-statement
+    config = config or {}
+    if not config.get("enabled", False) or METRICS_SERVER is not None:
+        return METRICS_SERVER
+    host = config.get("host", "0.0.0.0")
+    port = int(config.get("port", 9101))
+    try:
+        METRICS_SERVER = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as exp:
+        LOGGER.warning(f"Unable to start metrics endpoint on {host}:{port}: {exp}")
+        return None
+    METRICS_SERVER.daemon_threads = True
+    threading.Thread(target=METRICS_SERVER.serve_forever, name="myfox-metrics", daemon=True).start()
+    LOGGER.info(f"Metrics available on http://{host}:{port}/metrics")
+    return METRICS_SERVER
@@ -0,0 +1,86 @@
+"""Payload Logging
+
+Large payloads are only formatted when the log record is emitted, at DEBUG
+or for a sample of them, with secrets redacted.
+"""
+
+import logging
+import random
+from typing import Any, Dict, Optional
+
+from utils.codec import JSONDecodeError, dumps, loads
+
+REDACTED = "***"
+SECRET_KEYS = (
+    "token",
+    "password",
+    "secret",
+    "authorization",
+    "arcsofttoken",
+)
+
+PAYLOAD_LOG_CONFIG = {"sample_rate": 0.0}
+
+
+def init_payload_logging(config: Optional[Dict]) -> None:
+    """Init Payload Logging settings
+
+    Args:
+        config (Optional[Dict]): Payload logging Configuration (sample_rate)
+    """
+    config = config or {}
+    PAYLOAD_LOG_CONFIG["sample_rate"] = min(max(float(config.get("sample_rate", 0)), 0.0), 1.0)
+
+
+def is_secret(key: Any) -> bool:
+    """Check if a payload key holds a secret"""
+    key = str(key).lower()
+    return any(secret in key for secret in SECRET_KEYS)
+
+
+def redact(payload: Any) -> Any:
+    """Copy of a payload with secret values replaced
+
+    Args:
+        payload (Any): Payload
+
+    Returns:
+        Any: Redacted payload
+    """
+    if isinstance(payload, dict):
+        return {key: REDACTED if is_secret(key) else redact(value) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [redact(value) for value in payload]
+    return payload
+
+
+class LazyPayload:
+    """Payload formatted (and redacted) only if the log record is emitted"""
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+
+    def __str__(self) -> str:
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray, str)):
+            try:
+                payload = loads(payload)
+            except (JSONDecodeError, UnicodeDecodeError):
+                return payload.decode("utf8", errors="replace") if isinstance(payload, (bytes, bytearray)) else payload
+        return dumps(redact(payload), default=str).decode("utf8")
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """Log a payload at DEBUG, or at INFO for a sample of them (`log_payloads.sample_rate`)
+
+    Args:
+        logger (logging.Logger): Logger
+        label (str): Payload description
+        payload (Any): Payload
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, LazyPayload(payload))
+    elif PAYLOAD_LOG_CONFIG["sample_rate"] and random.random() < PAYLOAD_LOG_CONFIG["sample_rate"]:
+        logger.info("%s (sampled): %s", label, LazyPayload(payload))
@@ -0,0 +1,114 @@
+"""Persistent State Store"""
+
+import logging
+import sqlite3
+import threading
+from time import time
+from typing import Any, Dict, Optional
+
+from utils.codec import dumps, loads
+
+LOGGER = logging.getLogger(__name__)
+
+STATE_STORE_PATH = "state.db"
+
+
+class StateStore:
+    """SQLite key/value store of the last known state, grouped by namespace"""
+
+    def __init__(self, path: str = STATE_STORE_PATH):
+        """Init StateStore
+
+        Args:
+            path (str, optional): Database file. Defaults to STATE_STORE_PATH.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        """Get every value of a namespace
+
+        Args:
+            namespace (str): Namespace
+
+        Returns:
+            Dict[str, Any]: Values by key
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT key, value FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        return {key: loads(value) for key, value in rows}
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Get a value
+
+        Args:
+            namespace (str): Namespace
+            key (str): Key
+            default (Any, optional): Value if missing. Defaults to None.
+
+        Returns:
+            Any: Value
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return loads(row[0]) if row else default
+
+    def replace(self, namespace: str, values: Dict[str, Any]) -> None:
+        """Replace every value of a namespace
+
+        Args:
+            namespace (str): Namespace
+            values (Dict[str, Any]): Values by key
+        """
+        now = time()
+        rows = [(namespace, str(key), dumps(value, default=str).decode("utf8"), now) for key, value in values.items()]
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+            self.connection.executemany("INSERT INTO state VALUES (?, ?, ?, ?)", rows)
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        """Set a value
+
+        Args:
+            namespace (str): Namespace
+            key (str): Key
+            value (Any): Value (JSON serializable)
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)",
+                (namespace, key, dumps(value, default=str).decode("utf8"), time()),
+            )
+
+    def close(self) -> None:
+        """Close the database"""
+        with self.lock:
+            self.connection.close()
+
+
+def open_state_store(path: Optional[str]) -> Optional[StateStore]:
+    """Open the state store, disabled if path is empty
+
+    Args:
+        path (Optional[str]): Database file
+
+    Returns:
+        Optional[StateStore]: StateStore, None if disabled or unavailable
+    """
+    if not path:
+        return None
+    try:
+        return StateStore(path=path)
+    except sqlite3.Error as exp:
+        LOGGER.warning(f"Unable to open state store {path}: {exp}")
+        return None